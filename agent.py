@@ -1,81 +1,62 @@
 from mesa import Agent
 import numpy as np
+from choice import (
+    BUS, CAR, CLASSES, MODES, TIME_PER_MILE, TRAIN, nested_logit_probabilities, sample_choice,
+)
 
 class CommuterAgent(Agent):
-
-    def __init__(self, model, socio_group, income, car_owner, price_sensitivity, distance, time_value):
+    # Each agent holds only its row in the model's population arrays plus its own choice
+    # state. Incomes, distances, base times and costs live in model-level arrays, and ASCs
+    # in per-group tables, so millions of agents stay affordable in object mode.
+    # The slots only cover the three attributes below: mesa.Agent defines no __slots__, so
+    # every instance still carries a __dict__ (model, unique_id, pos) and the model's agent
+    # set keeps a reference to it. Object mode therefore costs roughly ten times the memory
+    # per agent of the vectorized engine (about 500 vs 50 bytes, see agent_memory.py); use
+    # the vectorized engine for the largest populations.
+    __slots__ = ("index", "mode_choice", "car_habit_streak")
+
+    def __init__(self, model, index):
         super().__init__(model)
-        self.socio_group = socio_group
-        self.income = income
-        self.car_owner = car_owner
-        self.price_sensitivity = price_sensitivity
+        self.index = index
         self.mode_choice = None
-        self.distance=distance
-        self.time_value = time_value
         self.car_habit_streak = 0
-        median_income = model.median_income  # e.g., 40000
-        base_vot = 10.0  # $10/hour at median
-        elasticity_vot = 1.0
-        elasticity_cost = 1.0
-
-        # Derived
-        self.value_of_time = 0.1 * (base_vot) * (self.income / median_income) ** elasticity_vot  # $/min
-        self.price_sensitivity = 0.1 * (median_income / self.income) ** elasticity_cost
-        
-        #transport mode utility constants
-        self.base_commute_time = {
-            "car": self.commute_time(self.distance, "car") * self.model.congestion_level,
-            "bus": self.commute_time(self.distance, "bus") * self.model.congestion_level,
-            "train": self.commute_time(self.distance, "train"),
-            "bike_walk": self.commute_time(self.distance, "bike_walk")
-        }
-
-        self.base_commute_cost = {
-            "car": model.car_cost + model.car_toll,
-            "bus": model.bus_cost,
-            "train": model.train_cost,
-            "bike_walk": 0.0  # assumed free
-        }
-        mode_shares = {
-            "car": 0.63,
-            "bus": 0.17,
-            "train": 0.12,
-            "bike_walk": 0.8  # Reference mode
-        }
-        income_mode_shares = {
-            "lower": {
-                "car": 0.47,
-                "bus": 0.25,
-                "train": 0.10,
-                "bike_walk": 0.18
-            },
-            "middle": {
-                "car": 0.60,
-                "bus": 0.15,
-                "train": 0.15,
-                "bike_walk": 0.10
-            },
-            "upper": {
-                "car": 0.70,
-                "bus": 0.05,
-                "train": 0.20,
-                "bike_walk": 0.05
-            }
-        }
-
-        # Choose reference mode
-        reference_mode = "bike_walk"
-
-        # Compute utility constants (ASCs) relative to reference
-        self.utility_constants = {}
-        reference_mode = "bike_walk"
-        shares = income_mode_shares[self.socio_group]
-
-        for mode, share in shares.items():
-            if mode == reference_mode:
-                self.utility_constants[mode] = 0.0
-            else:
-                self.utility_constants[mode] = np.log(share / shares[reference_mode])
+
+    @property
+    def socio_group(self):
+        return CLASSES[self.model.group_codes.item(self.index)]
+
+    @property
+    def income(self):
+        return self.model.incomes.item(self.index)
+
+    @property
+    def car_owner(self):
+        return bool(self.model.car_ownerships[self.index])
+
+    @property
+    def distance(self):
+        return self.model.distances.item(self.index)
+
+    @property
+    def time_value(self):
+        return self.model.time_values.item(self.index)
+
+    @property
+    def value_of_time(self):
+        # $/min: $10/hour at median income, elasticity 1
+        return self.model.values_of_time.item(self.index)
+
+    @property
+    def price_sensitivity(self):
+        return self.model.price_sensitivities.item(self.index)
+
+    @property
+    def base_commute_time(self):
+        return dict(zip(MODES, self.model.base_commute_times[self.index].tolist()))
+
+    @property
+    def base_commute_cost(self):
+        return dict(zip(MODES, self.model.base_commute_costs.tolist()))
 
     def say_hi(self):
         print(f"Hi, I am an agent, you can call me {self.unique_id!s}.")
@@ -88,11 +69,12 @@ class CommuterAgent(Agent):
         # Update model's mode counts
         previous_mode = self.mode_choice
         self.mode_choice = new_mode
+        socio_group = self.socio_group
 
         if previous_mode is not None:
-            self.model.mode_counts[previous_mode][self.socio_group] -= 1
+            self.model.mode_counts[previous_mode][socio_group] -= 1
             self.model.total_mode_counts[previous_mode] -= 1
-        self.model.mode_counts[new_mode][self.socio_group] += 1
+        self.model.mode_counts[new_mode][socio_group] += 1
         self.model.total_mode_counts[new_mode] += 1
         if self.mode_choice == "car":
             self.car_habit_streak += 1
@@ -100,67 +82,69 @@ class CommuterAgent(Agent):
             self.car_habit_streak = 0
 
     def calculate_utilities(self):
-
+        model = self.model
+        i = self.index
         utilities = {}
+        # ASCs are stored once per socio group on the model
+        utility_constants = model.utility_constants[CLASSES[model.group_codes.item(i)]]
+        income = model.incomes.item(i)
+        price_sensitivity = model.price_sensitivities.item(i)
+        value_of_time = model.values_of_time.item(i)
+        base_time = model.base_commute_times[i].tolist()
+        base_cost = model.base_commute_costs_list
+        congestion_ratio = model.congestion_level / model.base_congestion_level
 
         base = 1.5
-        bonus = base + 0.1 * self.car_habit_streak - 0.5 * (self.income / self.model.median_income)
+        bonus = base + 0.1 * self.car_habit_streak - 0.5 * (income / model.median_income)
         stickiness_bonus = max(0, bonus)
 
-        if self.car_owner:
-            curr_time = self.commute_time(self.distance, "car") * self.model.congestion_level
-            time_delta = curr_time - self.base_commute_time["car"]
+        if model.car_ownerships.item(i):
+            time_delta = base_time[CAR] * congestion_ratio - base_time[CAR]
 
-            curr_cost = self.model.car_cost + self.model.car_toll
-            cost_delta = curr_cost - self.base_commute_cost["car"]
+            curr_cost = model.car_cost + model.car_toll
+            cost_delta = curr_cost - base_cost[CAR]
 
-            utilities["car"] = self.utility_constants["car"] + stickiness_bonus \
-            - self.price_sensitivity * cost_delta \
-            - self.value_of_time * time_delta
+            utilities["car"] = utility_constants["car"] + stickiness_bonus \
+            - price_sensitivity * cost_delta \
+            - value_of_time * time_delta
         else:
             utilities["car"] = -np.inf
 
         # Bus utility
-        curr_time = self.commute_time(self.distance, "bus") * self.model.congestion_level
-        time_delta = curr_time - self.base_commute_time["bus"]
-
-        curr_cost = self.model.bus_cost * (1.0 - self.model.fare_discount)
-        cost_delta = curr_cost - self.base_commute_cost["bus"]
+        time_delta = base_time[BUS] * congestion_ratio - base_time[BUS]
 
-        utilities["bus"] = self.utility_constants["bus"] \
-            - self.price_sensitivity * cost_delta \
-            - self.value_of_time * time_delta
+        curr_cost = model.bus_cost * (1.0 - model.fare_discount)
+        cost_delta = curr_cost - base_cost[BUS]
 
-        # Train utility
-        curr_time = self.commute_time(self.distance, "train")
-        time_delta = curr_time - self.base_commute_time["train"]
+        utilities["bus"] = utility_constants["bus"] \
+            - price_sensitivity * cost_delta \
+            - value_of_time * time_delta
 
-        curr_cost = self.model.train_cost * (1.0 - self.model.fare_discount)
-        cost_delta = curr_cost - self.base_commute_cost["train"]
+        # Train utility (train and bike/walk times do not depend on congestion)
+        curr_cost = model.train_cost * (1.0 - model.fare_discount)
+        cost_delta = curr_cost - base_cost[TRAIN]
 
-        utilities["train"] = self.utility_constants["train"] \
-            - self.price_sensitivity * cost_delta \
-            - self.value_of_time * time_delta
+        utilities["train"] = utility_constants["train"] \
+            - price_sensitivity * cost_delta
 
         # Bike/Walk utility
-        curr_time = self.commute_time(self.distance, "bike_walk")
-        time_delta = curr_time - self.base_commute_time["bike_walk"]
-
-        utilities["bike_walk"] = self.utility_constants["bike_walk"] \
-            - self.value_of_time * time_delta
+        utilities["bike_walk"] = utility_constants["bike_walk"]
         return utilities
-    
+
     def commute_time(self, distance, mode):
-    # Minutes per mile (based on empirical averages)
-        time_per_mile = {
-            "car": 4.5,
-            "bus": 4.8,
-            "train": 5.6,
-            "bike_walk": 15.0
-        }
-        return distance * time_per_mile[mode] / 60.0
+        return distance * TIME_PER_MILE[mode] / 60.0
 
     def choose_mode(self, utilities):
+        # The model draws one uniform per agent and step (see TransportModel.step_agents)
+        draw = self.model.choice_draws.item(self.index)
+        if self.model.choice_model == "nested":
+            probs = nested_logit_probabilities(
+                np.array([[utilities[m] for m in MODES]]),
+                self.model.lambda_private,
+                self.model.lambda_public,
+            )[0]
+            return MODES[sample_choice(probs.tolist(), draw)]
+
         # Normalize utilities for numerical stability (logit-safe)
         max_utility = max(utilities.values())
         adjusted_utilities = {m: utilities[m] - max_utility for m in utilities}
@@ -172,9 +156,9 @@ class CommuterAgent(Agent):
         # Compute choice probabilities
         probs = {m: exp_utilities[m] / total for m in utilities}
 
-        # Draw mode based on probabilities
+        # Draw mode based on probabilities (inverse CDF, like the vectorized engine)
         modes = list(probs.keys())
         prob_values = list(probs.values())
-        chosen_mode = np.random.choice(modes, p=prob_values)
+        chosen_mode = modes[sample_choice(prob_values, draw)]
 
         return chosen_mode
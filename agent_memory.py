@@ -0,0 +1,48 @@
+import argparse
+import json
+import tracemalloc
+import numpy as np
+from model import TransportModel
+
+# Reports the memory cost of a population in bytes per agent: everything the model allocates
+# while being built (agent objects, Mesa's agent registries, population arrays), split into
+# the per-agent numpy arrays and the rest. Object mode at 2M agents needs this to stay small.
+
+
+def measure_agent_memory(num_agents=100000, engine="agents", seed=0):
+    tracemalloc.start()
+    try:
+        model = TransportModel(num_agents=num_agents, engine=engine, seed=seed, history_sample=0)
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    arrays = sum(
+        value.nbytes for value in vars(model).values()
+        if isinstance(value, np.ndarray) and len(value) == num_agents
+    )
+    return {
+        "engine": engine,
+        "num_agents": num_agents,
+        "bytes_per_agent": allocated / num_agents,
+        "array_bytes_per_agent": arrays / num_agents,
+        "object_bytes_per_agent": (allocated - arrays) / num_agents,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure model memory per agent")
+    parser.add_argument("--num-agents", type=int, default=100000)
+    parser.add_argument("--engines", nargs="+", default=["agents", "vectorized"])
+    parser.add_argument("--output", help="write the measurements as JSON to this file")
+    args = parser.parse_args()
+
+    results = [measure_agent_memory(args.num_agents, engine) for engine in args.engines]
+    for result in results:
+        print(
+            f"{result['engine']}: {result['bytes_per_agent']:.0f} bytes/agent "
+            f"({result['array_bytes_per_agent']:.0f} in arrays, "
+            f"{result['object_bytes_per_agent']:.0f} in objects)"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -1,13 +1,11 @@
-import matplotlib.pyplot as plt
+import time
+
+_import_started = time.perf_counter()
+
 import solara
-import pandas as pd
-import mesa
-from model import TransportModel
-from mesa.visualization import (
-    Slider,
-    SolaraViz,
-    make_plot_component,
-)
+
+# Heavy imports (mesa, matplotlib, the model itself) happen on first render, so workers
+# can load this module and start serving quickly. startup_time.py tracks the cost.
 
 # Fixed parameters
 NUM_AGENTS = 2000000
@@ -17,48 +15,72 @@ TRAIN_COST = 3.0
 LAMBDA_PRIVATE = 0.8
 LAMBDA_PUBLIC = 0.6
 ROAD_CAPACITY = 10000
-
-model1 = TransportModel()
-
-
-CongestionPlot = make_plot_component("congestion_level")
-GHGPlot = make_plot_component("total_ghg_sum")
-ProfitPlot = make_plot_component("total_system_profit")
-ModePlot = make_plot_component({
-    "car_share_pct": (1.0, 0.0, 0.0),        # Red
-    "bus_share_pct": (0.0, 0.0, 1.0),         # Blue
-    "train_share_pct": (0.0, 0.5, 0.0),       # Darker Green
-    "bike_walk_share_pct": (0.0, 0.0, 0.0),   # White
-})
-UpperModePlot = make_plot_component({
-    "car_share_pct_upper": (1.0, 0.0, 0.0),        # Red
-    "bus_share_pct_upper": (0.0, 0.0, 1.0),         # Blue
-    "train_share_pct_upper": (0.0, 0.5, 0.0),       # Darker Green
-    "bike_walk_share_pct_upper": (0.0, 0.0, 0.0),   # White
-})
-MiddleModePlot = make_plot_component({
-    "car_share_pct_middle": (1.0, 0.0, 0.0),        # Red
-    "bus_share_pct_middle": (0.0, 0.0, 1.0),         # Blue
-    "train_share_pct_middle": (0.0, 0.5, 0.0),       # Darker Green
-    "bike_walk_share_pct_middle": (0.0, 0.0, 0.0),   # White
-})
-LowerModePlot = make_plot_component({
-    "car_share_pct_lower": (1.0, 0.0, 0.0),        # Red
-    "bus_share_pct_lower": (0.0, 0.0, 1.0),         # Blue
-    "train_share_pct_lower": (0.0, 0.5, 0.0),       # Darker Green
-    "bike_walk_share_pct_lower": (0.0, 0.0, 0.0),   # White
-})
+ENGINE = "vectorized"   # array engine; "agents" steps Mesa agent objects
+POPULATION_CACHE = ".population_cache"   # seeded populations are reused across runs and workers
+
+
+def make_plot_components():
+    from mesa.visualization import make_plot_component
+
+    CongestionPlot = make_plot_component("congestion_level")
+    GHGPlot = make_plot_component("total_ghg_sum")
+    ProfitPlot = make_plot_component("total_system_profit")
+    ModePlot = make_plot_component({
+        "car_share_pct": (1.0, 0.0, 0.0),        # Red
+        "bus_share_pct": (0.0, 0.0, 1.0),         # Blue
+        "train_share_pct": (0.0, 0.5, 0.0),       # Darker Green
+        "bike_walk_share_pct": (0.0, 0.0, 0.0),   # White
+    })
+    UpperModePlot = make_plot_component({
+        "car_share_pct_upper": (1.0, 0.0, 0.0),        # Red
+        "bus_share_pct_upper": (0.0, 0.0, 1.0),         # Blue
+        "train_share_pct_upper": (0.0, 0.5, 0.0),       # Darker Green
+        "bike_walk_share_pct_upper": (0.0, 0.0, 0.0),   # White
+    })
+    MiddleModePlot = make_plot_component({
+        "car_share_pct_middle": (1.0, 0.0, 0.0),        # Red
+        "bus_share_pct_middle": (0.0, 0.0, 1.0),         # Blue
+        "train_share_pct_middle": (0.0, 0.5, 0.0),       # Darker Green
+        "bike_walk_share_pct_middle": (0.0, 0.0, 0.0),   # White
+    })
+    LowerModePlot = make_plot_component({
+        "car_share_pct_lower": (1.0, 0.0, 0.0),        # Red
+        "bus_share_pct_lower": (0.0, 0.0, 1.0),         # Blue
+        "train_share_pct_lower": (0.0, 0.5, 0.0),       # Darker Green
+        "bike_walk_share_pct_lower": (0.0, 0.0, 0.0),   # White
+    })
+    return [ModePlot, PercentageDisplay,
+            UpperModePlot, PercentageDisplayUpper,
+            MiddleModePlot, PercentageDisplayMiddle,
+            LowerModePlot, PercentageDisplayLower,
+            CongestionPlot, GHGPlot, ProfitPlot]
 
 model_params = {
     "num_agents": NUM_AGENTS,
-    "fare_discount": Slider("Public Transport Fare Discount (%)", 0.0, 0.0, 1.0, 0.005),
-    "car_toll": Slider("Car Toll ($)", 0.0, 0.0, 20.0, 0.5),
+    "fare_discount": {
+        "type": "SliderFloat",
+        "value": 0.0,
+        "label": "Public Transport Fare Discount (%)",
+        "min": 0.0,
+        "max": 1.0,
+        "step": 0.005,
+    },
+    "car_toll": {
+        "type": "SliderFloat",
+        "value": 0.0,
+        "label": "Car Toll ($)",
+        "min": 0.0,
+        "max": 20.0,
+        "step": 0.5,
+    },
     "car_cost": CAR_COST,
     "bus_cost": BUS_COST,
     "train_cost": TRAIN_COST,
     "lambda_private": LAMBDA_PRIVATE,
     "lambda_public": LAMBDA_PUBLIC,
     "road_capacity": ROAD_CAPACITY,
+    "engine": ENGINE,
+    "population_cache": POPULATION_CACHE,
     "seed": {
         "type": "InputText",
         "value": 42,
@@ -75,6 +97,8 @@ model_params_batch = {
     "lambda_private": LAMBDA_PRIVATE,
     "lambda_public": LAMBDA_PUBLIC,
     "road_capacity": ROAD_CAPACITY,
+    "engine": ENGINE,
+    "population_cache": POPULATION_CACHE,
 }
 
 def PercentageDisplay(model):
@@ -116,48 +140,78 @@ def PercentageDisplayLower(model):
 
 @solara.component
 def GHGPolicyPlot(model):
-    results = mesa.batch_run(
-        TransportModel,
-        parameters=model_params_batch,
+    # The sweep runs as a memoized background job; this component only follows its progress
+    # and plots whatever cells have finished so far.
+    import matplotlib.pyplot as plt
+    from sweep_jobs import sweep_job
+
+    job = sweep_job(
+        model_params_batch,
         iterations=5,
         max_steps=5,
-        number_processes=1,
+        reporters=["total_ghg"],
         data_collection_period=9,
-        display_progress=True,
+        max_tasks_per_child=1,          # 2M-agent runs: free each run's memory before the next
     )
+    completed, set_completed = solara.use_state(job.completed)
 
+    def follow_progress(cancel):
+        seen = job.completed
+        while not cancel.is_set() and not job.done:
+            seen = job.wait_for_progress(seen, timeout=1.0)
+            set_completed(seen)
+        set_completed(job.completed)
 
-    df = pd.DataFrame(results)
-    df["policy_label"] = df.apply(
-        lambda row: f"transit discount={row['fare_discount']}, toll={row['car_toll']}", axis=1
-    )
-    grouped = df.groupby(["policy_label", "Step"]).mean(numeric_only=True).reset_index()
+    solara.use_thread(follow_progress, dependencies=[job])
+
+    with solara.Column():
+        if job.error is not None:
+            solara.Error(f"Policy sweep failed: {job.error!r}")
+            return
+        if not job.done:
+            solara.ProgressLinear(value=100 * completed / job.total)
+            solara.Text(f"Policy sweep: {completed}/{job.total} runs finished")
+
+        df = job.frame()
+        if df.empty:
+            return
+
+        df["policy_label"] = df.apply(
+            lambda row: f"transit discount={row['fare_discount']}, toll={row['car_toll']}", axis=1
+        )
+        grouped = df.groupby(["policy_label", "Step"]).mean(numeric_only=True).reset_index()
 
-    fig, ax = plt.subplots(figsize=(24, 14), dpi=150)
-    for label in grouped["policy_label"].unique():
-        sub = grouped[grouped["policy_label"] == label]
-        ax.plot(sub["Step"], sub["total_ghg"], label=label)
+        fig, ax = plt.subplots(figsize=(24, 14), dpi=150)
+        for label in grouped["policy_label"].unique():
+            sub = grouped[grouped["policy_label"] == label]
+            ax.plot(sub["Step"], sub["total_ghg"], label=label)
 
-    ax.set_title("Total GHG Emissions Over Time by Policy Suite")
-    ax.set_xlabel("Step")
-    ax.set_ylabel("Total GHG Emissions")
-    ax.legend(fontsize="small", loc="center left", bbox_to_anchor=(1.05, 0.5))
-    ax.grid(True)
-    fig.tight_layout()
+        ax.set_title("Total GHG Emissions Over Time by Policy Suite")
+        ax.set_xlabel("Step")
+        ax.set_ylabel("Total GHG Emissions")
+        ax.legend(fontsize="small", loc="center left", bbox_to_anchor=(1.05, 0.5))
+        ax.grid(True)
+        fig.tight_layout()
 
-    return solara.FigureMatplotlib(fig)
+        solara.FigureMatplotlib(fig)
 
 
 
-page = SolaraViz(
-    model1,
-    components=[ModePlot, PercentageDisplay, 
-                UpperModePlot, PercentageDisplayUpper, 
-                MiddleModePlot, PercentageDisplayMiddle, 
-                LowerModePlot, PercentageDisplayLower, 
-                CongestionPlot, GHGPlot, ProfitPlot],
-    model_params=model_params,
-    name="Transportation Mode Choice Model",
-)
+@solara.component
+def Page():
+    # The model is built per session on first render, not at import
+    from mesa.visualization import SolaraViz
+    from model import TransportModel
+
+    model1 = solara.use_memo(lambda: TransportModel(engine=ENGINE), [])
+    components = solara.use_memo(make_plot_components, [])
+    SolaraViz(
+        model1,
+        components=components,
+        model_params=model_params,
+        name="Transportation Mode Choice Model",
+    )
+
 
-page
+page = Page()
+STARTUP_SECONDS = time.perf_counter() - _import_started
@@ -0,0 +1,209 @@
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+# Reproducible benchmarks for TransportModel: construction, step throughput, update_congestion,
+# DataCollector collection and peak RSS across population sizes, plus a short end-to-end policy
+# sweep shaped like the one GHGPolicyPlot runs. Every case runs in a fresh interpreter with a
+# fixed seed, so peak RSS is per case. Each case runs --runs times and reports the median of
+# every metric. Results are written as JSON and can be compared against an earlier run with
+# --baseline; a metric regresses only if it got worse by more than the relative tolerance and
+# by more than its absolute floor, so sub-microsecond timings do not flag on scheduler noise.
+SEED = 42
+SIZES = [20000, 200000, 2000000]
+ENGINES = ["vectorized", "agents"]
+MAX_OBJECT_AGENTS = 200000        # the agents engine takes minutes per step beyond this
+# (metric, higher is better, absolute floor) compared against a baseline; the floor is the
+# smallest change in the metric's own units that can count as a regression
+METRICS = [
+    ("construct_seconds", False, 0.05),
+    ("agents_per_second", True, 0.0),
+    ("update_congestion_us", False, 1.0),
+    ("collect_us", False, 5.0),
+    ("peak_rss_mb", False, 10.0),
+    ("sweep_seconds", False, 0.5),
+]
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def repeat_timing(function, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - started) / repeats
+
+
+def model_case(num_agents, engine, steps, repeats):
+    from model import TransportModel
+
+    started = time.perf_counter()
+    model = TransportModel(num_agents=num_agents, engine=engine, seed=SEED, history_sample=0)
+    construct = time.perf_counter() - started
+
+    step_times = []
+    for _ in range(steps):
+        started = time.perf_counter()
+        model.step()
+        step_times.append(time.perf_counter() - started)
+    step_seconds = float(np.median(step_times))
+
+    update_congestion = repeat_timing(model.update_congestion, repeats)
+    collect = repeat_timing(lambda: model.datacollector.collect(model), repeats)
+    return {
+        "construct_seconds": construct,
+        "step_seconds": step_seconds,
+        "agents_per_second": num_agents / step_seconds,
+        "update_congestion_us": update_congestion * 1e6,
+        "collect_us": collect * 1e6,
+        "car_share_pct": model.car_share_pct,
+    }
+
+
+def sweep_case(num_agents, processes):
+    # The GHGPolicyPlot sweep (app.model_params_batch, 5 iterations of 5 steps), end to end
+    from app import model_params_batch
+    from sweep import run_sweep
+
+    parameters = {**model_params_batch, "num_agents": num_agents, "population_cache": None}
+    started = time.perf_counter()
+    frame = run_sweep(
+        parameters, iterations=5, max_steps=5, reporters=["total_ghg"],
+        data_collection_period=9, processes=processes, seed=SEED,
+    )
+    return {"sweep_seconds": time.perf_counter() - started, "sweep_rows": len(frame)}
+
+
+def run_case(case):
+    if case["kind"] == "sweep":
+        result = sweep_case(case["num_agents"], case.get("processes"))
+    else:
+        result = model_case(case["num_agents"], case["engine"], case["steps"], case["repeats"])
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def case_name(case):
+    if case["kind"] == "sweep":
+        return f"sweep/{case['num_agents']}"
+    return f"{case['engine']}/{case['num_agents']}"
+
+
+def benchmark_cases(sizes, engines, steps, repeats, sweep_agents, processes):
+    cases = [
+        {"kind": "model", "engine": engine, "num_agents": size, "steps": steps, "repeats": repeats}
+        for engine in engines
+        for size in sizes
+        if engine != "agents" or size <= MAX_OBJECT_AGENTS
+    ]
+    if sweep_agents:
+        cases.append({"kind": "sweep", "num_agents": sweep_agents, "processes": processes})
+    return cases
+
+
+def run_subprocess(case):
+    out = subprocess.run(
+        [sys.executable, __file__, "--case", json.dumps(case)],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def median_result(samples):
+    # Per-metric median over repeated runs of one case
+    return {name: float(np.median([sample[name] for sample in samples])) for name in samples[0]}
+
+
+def run_benchmarks(cases, runs=3):
+    results = {}
+    for case in cases:
+        samples = [run_subprocess(case) for _ in range(runs)]
+        results[case_name(case)] = {**case, **median_result(samples), "runs": runs}
+        print(format_result(case_name(case), results[case_name(case)]), flush=True)
+    return {
+        "seed": SEED,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def format_result(name, result):
+    if "sweep_seconds" in result:
+        return f"{name}: {result['sweep_seconds']:.2f}s, peak RSS {result['peak_rss_mb']:.0f} MB"
+    return (
+        f"{name}: construct {result['construct_seconds']:.2f}s, "
+        f"{result['agents_per_second']:,.0f} agents/s per step, "
+        f"update_congestion {result['update_congestion_us']:.1f}us, "
+        f"collect {result['collect_us']:.1f}us, peak RSS {result['peak_rss_mb']:.0f} MB"
+    )
+
+
+def compare(current, baseline, tolerance=0.1):
+    # Relative change per metric for cases present in both runs; a regression is a change
+    # in the wrong direction by more than tolerance and by more than the metric's floor
+    rows = []
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        for metric, higher_is_better, floor in METRICS:
+            if metric not in result or metric not in before or not before[metric]:
+                continue
+            change = result[metric] / before[metric] - 1
+            worse = -change if higher_is_better else change
+            delta = abs(result[metric] - before[metric])
+            rows.append({
+                "case": name,
+                "metric": metric,
+                "baseline": before[metric],
+                "current": result[metric],
+                "change": change,
+                "regression": worse > tolerance and delta > floor,
+            })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark TransportModel construction, stepping and memory")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--engines", nargs="+", default=ENGINES)
+    parser.add_argument("--steps", type=int, default=5, help="timed steps per model case")
+    parser.add_argument("--repeats", type=int, default=1000, help="calls per update_congestion/collect timing")
+    parser.add_argument("--runs", type=int, default=3, help="fresh-interpreter runs per case; metrics are medians")
+    parser.add_argument("--sweep-agents", type=int, default=20000, help="population for the sweep case (0 skips it)")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change counted as a regression")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        sys.exit(0)
+
+    cases = benchmark_cases(args.sizes, args.engines, args.steps, args.repeats, args.sweep_agents, args.processes)
+    report = run_benchmarks(cases, args.runs)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.tolerance)
+        for row in rows:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"{row['case']} {row['metric']}: {row['baseline']:.4g} -> {row['current']:.4g} ({row['change']:+.1%}){flag}")
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
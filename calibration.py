@@ -0,0 +1,111 @@
+import numpy as np
+from choice import CLASSES, MODES, REFERENCE_MODE, income_mode_shares
+from cohorts import DISTANCE_BINS, INCOME_BINS
+from equilibrium import expected_share_path
+
+# Calibrates the per-group ASCs so that the model's expected mode shares over the months it
+# actually simulates before the policy switch (1..policy_step by default) match a target
+# share table. Expected shares come from equilibrium.expected_share_path, which carries the
+# habit streak distribution forward from streak 0 the way a run does; the stationary
+# equilibrium is not used, since runs never get near it. Each iteration is one such pass on
+# the cohort grid, followed by a quasi-Newton step on the log-odds gap against the reference
+# mode. The first step is the usual contraction (asc -= gap); Broyden updates then pick up
+# the habit and congestion feedback that makes the plain contraction converge slowly.
+# Car shares above a group's car ownership rate cannot be reached (non-owners never drive).
+# For such groups the car target is lowered to max_owner_car_share of the owners and the
+# other modes keep their relative target shares; they are listed in "infeasible_groups".
+
+
+def share_table(shares):
+    # (class, mode) array from a {group: {mode: share}} dict, rows normalized to 1
+    table = np.array([[shares[group][mode] for mode in MODES] for group in CLASSES], dtype=float)
+    return table / table.sum(axis=1, keepdims=True)
+
+
+def feasible_targets(model, target, max_owner_car_share=0.95):
+    groups = np.bincount(model.group_codes, minlength=len(CLASSES))
+    owners = np.bincount(model.group_codes, weights=model.car_ownerships, minlength=len(CLASSES))
+    car_limit = max_owner_car_share * owners / np.maximum(groups, 1)
+    car = MODES.index("car")
+    adjusted = target.copy()
+    infeasible = target[:, car] > car_limit
+    for g in np.flatnonzero(infeasible):
+        others = np.arange(len(MODES)) != car
+        adjusted[g, car] = car_limit[g]
+        adjusted[g, others] *= (1 - car_limit[g]) / target[g, others].sum()
+    return adjusted, [CLASSES[g] for g in np.flatnonzero(infeasible)]
+
+
+def expected_share_table(model, months, cohort_bins=(INCOME_BINS, DISTANCE_BINS)):
+    # (class, mode) shares averaged over months 1..months at baseline conditions (the initial
+    # toll, no fare discount), and the congestion level of the last month
+    cohorts, counts, congestion = expected_share_path(
+        model, months, car_toll=0.0, fare_discount=0.0, cohort_bins=cohort_bins
+    )
+    total = np.mean(counts, axis=0)
+    table = np.array([total[cohorts["group"] == g].sum(axis=0) for g in range(len(CLASSES))])
+    return table / table.sum(axis=1, keepdims=True), congestion[-1]
+
+
+def calibrate_constants(
+    model,
+    targets=income_mode_shares,
+    tol=1e-4,
+    max_iter=50,
+    months=None,
+    cohort_bins=(INCOME_BINS, DISTANCE_BINS),
+    max_owner_car_share=0.95,
+    apply=True,
+):
+    # Returns the calibrated constants as {group: {mode: asc}} (bike/walk fixed at 0) plus
+    # convergence information. With apply=True the model uses them from then on. The
+    # returned (and applied) table is always the last one whose shares were measured.
+    months = model.policy_step if months is None else months
+    target, infeasible_groups = feasible_targets(model, share_table(targets), max_owner_car_share)
+    reference = MODES.index(REFERENCE_MODE)
+    original = model.utility_constant_table.copy()
+    table = original.copy()
+    log_target = np.log(target) - np.log(target[:, [reference]])
+    free = [m for m in range(len(MODES)) if m != reference]
+    jacobian = np.eye(len(CLASSES) * len(free))
+    previous = None
+    history = []
+    converged = False
+    for iteration in range(1, max_iter + 1):
+        model.set_utility_constants(table)
+        simulated, congestion_level = expected_share_table(model, months, cohort_bins)
+        error = np.abs(simulated - target).max()
+        history.append(error)
+        converged = error < tol
+        if converged or iteration == max_iter:
+            break
+        simulated = np.maximum(simulated, 1e-300)
+        gap = (np.log(simulated) - np.log(simulated[:, [reference]]) - log_target)[:, free].ravel()
+        x = table[:, free].ravel()
+        if previous is not None:
+            # Broyden update of the (ASC -> log-odds gap) Jacobian, starting from the identity
+            dx, dgap = x - previous[0], gap - previous[1]
+            if dx @ dx > 0:
+                jacobian += np.outer(dgap - jacobian @ dx, dx) / (dx @ dx)
+        previous = (x, gap)
+        table = table.copy()
+        table[:, free] = (x - np.linalg.solve(jacobian, gap)).reshape(len(CLASSES), -1)
+        table[:, reference] = 0.0
+
+    model.set_utility_constants(table if apply else original)
+    return {
+        "utility_constants": {
+            group: dict(zip(MODES, table[g].tolist())) for g, group in enumerate(CLASSES)
+        },
+        "utility_constant_table": table,
+        "converged": converged,
+        "iterations": iteration,
+        "max_share_error": error,
+        "residuals": simulated - target,
+        "targets": target,
+        "infeasible_groups": infeasible_groups,
+        "shares": simulated,
+        "congestion_level": congestion_level,
+        "months": months,
+        "history": history,
+    }
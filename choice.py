@@ -0,0 +1,217 @@
+import numpy as np
+
+# Shared mode-choice tables used by both the agent and the vectorized engine.
+# Array columns always follow MODES and rows follow CLASSES.
+MODES = ["car", "bus", "train", "bike_walk"]
+CLASSES = ["upper", "middle", "lower"]
+CAR, BUS, TRAIN, BIKE_WALK = range(len(MODES))
+
+# Minutes per mile (based on empirical averages)
+TIME_PER_MILE = {
+    "car": 4.5,
+    "bus": 4.8,
+    "train": 5.6,
+    "bike_walk": 15.0
+}
+TIME_PER_MILE_ARRAY = np.array([TIME_PER_MILE[m] for m in MODES])
+
+income_mode_shares = {
+    "lower": {
+        "car": 0.47,
+        "bus": 0.25,
+        "train": 0.10,
+        "bike_walk": 0.18
+    },
+    "middle": {
+        "car": 0.60,
+        "bus": 0.15,
+        "train": 0.15,
+        "bike_walk": 0.10
+    },
+    "upper": {
+        "car": 0.70,
+        "bus": 0.05,
+        "train": 0.20,
+        "bike_walk": 0.05
+    }
+}
+REFERENCE_MODE = "bike_walk"
+
+# Nested-logit nests (as in the estimation notebook); each nest has its own lambda
+NESTS = {
+    "private": ["car", "bike_walk"],
+    "public": ["bus", "train"],
+}
+NEST_INDEX = {nest: [MODES.index(m) for m in modes] for nest, modes in NESTS.items()}
+
+
+def utility_constants_for(shares, reference_mode=REFERENCE_MODE):
+    # ASCs as log share ratios against the reference mode
+    constants = {}
+    for mode, share in shares.items():
+        if mode == reference_mode:
+            constants[mode] = 0.0
+        else:
+            constants[mode] = np.log(share / shares[reference_mode])
+    return constants
+
+
+def utility_constant_table(mode_shares=income_mode_shares):
+    # (class, mode) array of ASCs, rows in CLASSES order
+    table = np.zeros((len(CLASSES), len(MODES)))
+    for g, group in enumerate(CLASSES):
+        constants = utility_constants_for(mode_shares[group])
+        table[g] = [constants[m] for m in MODES]
+    return table
+
+
+def utility_terms(model, income, distance):
+    # Per-agent utility terms that depend on neither policy, congestion nor habits; callers
+    # that evaluate the same agents many times can compute them once and pass them in
+    income_ratio = income / model.median_income
+    return {
+        "value_of_time": 0.1 * 10.0 * income_ratio,
+        "price_sensitivity": 0.1 / income_ratio,
+        "habit_income": 0.5 * income_ratio,
+        "car_time": distance * TIME_PER_MILE["car"] / 60.0,
+        "bus_time": distance * TIME_PER_MILE["bus"] / 60.0,
+    }
+
+
+def utility_matrix(model, income, distance, car_owner, group, streak,
+                   congestion_level=None, car_toll=None, fare_discount=None, terms=None):
+    # Batched version of CommuterAgent.calculate_utilities: one row per agent,
+    # one column per mode. Policy/congestion default to the model's current state.
+    # streak, congestion_level, car_toll and fare_discount may carry a leading scenario
+    # axis, e.g. (K, 1) policies with (K, agents) streaks, giving (K, agents, mode) utilities.
+    if congestion_level is None:
+        congestion_level = model.congestion_level
+    if car_toll is None:
+        car_toll = model.car_toll
+    if fare_discount is None:
+        fare_discount = model.fare_discount
+    if terms is None:
+        terms = utility_terms(model, income, distance)
+
+    value_of_time = terms["value_of_time"]
+    price_sensitivity = terms["price_sensitivity"]
+    constants = model.utility_constant_table[group]
+    base_congestion = model.base_congestion_level
+
+    shape = np.broadcast_shapes(
+        np.shape(streak), np.shape(congestion_level), np.shape(car_toll), np.shape(fare_discount),
+        (len(group),),
+    )
+    utilities = np.empty(shape + (len(MODES),))
+
+    stickiness_bonus = np.maximum(0, 1.5 + 0.1 * streak - terms["habit_income"])
+    car_time = terms["car_time"]
+    time_delta = car_time * congestion_level - car_time * base_congestion
+    cost_delta = (model.car_cost + car_toll) - (model.car_cost + model.base_car_toll)
+    utilities[..., CAR] = np.where(
+        car_owner,
+        constants[:, CAR] + stickiness_bonus
+        - price_sensitivity * cost_delta
+        - value_of_time * time_delta,
+        -np.inf,
+    )
+
+    bus_time = terms["bus_time"]
+    time_delta = bus_time * congestion_level - bus_time * base_congestion
+    cost_delta = model.bus_cost * (1.0 - fare_discount) - model.bus_cost
+    utilities[..., BUS] = constants[:, BUS] \
+        - price_sensitivity * cost_delta \
+        - value_of_time * time_delta
+
+    # Train and bike/walk times do not depend on congestion
+    cost_delta = model.train_cost * (1.0 - fare_discount) - model.train_cost
+    utilities[..., TRAIN] = constants[:, TRAIN] - price_sensitivity * cost_delta
+
+    utilities[..., BIKE_WALK] = constants[:, BIKE_WALK]
+    return utilities
+
+
+def row_max(values):
+    # Max over the (few) columns; column-wise ufuncs are much faster than axis=1 reductions
+    # on narrow arrays
+    top = values[:, 0].copy()
+    for m in range(1, values.shape[1]):
+        np.maximum(top, values[:, m], out=top)
+    return top
+
+
+def row_sum(values):
+    # Left-to-right sum over the columns, the same order as sum(axis=1) on narrow rows
+    total = values[:, 0].copy()
+    for m in range(1, values.shape[1]):
+        total += values[:, m]
+    return total
+
+
+def choice_probabilities(utilities):
+    # Row-wise softmax, shifted by the row max for numerical stability
+    exp_utilities = np.exp(utilities - row_max(utilities)[:, None])
+    return exp_utilities / row_sum(exp_utilities)[:, None]
+
+
+def nested_logit_probabilities(utilities, lambda_private, lambda_public):
+    # Row-wise nested logit: P(mode) = P(nest) * P(mode | nest), with nest inclusive values
+    # scaled by each nest's lambda. lambda_private = lambda_public = 1 is the plain logit.
+    lambdas = {"private": lambda_private, "public": lambda_public}
+    probs = np.zeros(utilities.shape)
+    nest_utilities = []
+    for nest, members in NEST_INDEX.items():
+        scaled = utilities[:, members] / lambdas[nest]
+        top = scaled.max(axis=1, keepdims=True)
+        exp_scaled = np.exp(scaled - top)
+        total = exp_scaled.sum(axis=1, keepdims=True)
+        probs[:, members] = exp_scaled / total
+        nest_utilities.append(lambdas[nest] * (top[:, 0] + np.log(total[:, 0])))
+    nest_probs = choice_probabilities(np.stack(nest_utilities, axis=1))
+    for k, members in enumerate(NEST_INDEX.values()):
+        probs[:, members] *= nest_probs[:, k:k + 1]
+    return probs
+
+
+def sample_choices(probs, draws):
+    # Inverse-CDF draw: one uniform per row picks the mode index (the number of
+    # cumulative probabilities, left to right, that the draw reaches)
+    choices = np.zeros(len(probs), dtype=np.int8)
+    cumulative = np.zeros(len(probs))
+    for m in range(probs.shape[1] - 1):
+        cumulative += probs[:, m]
+        choices += draws >= cumulative
+    return choices
+
+
+def sample_choice(probs, draw):
+    # sample_choices for a single row (same running sum, so the same pick)
+    cumulative = 0.0
+    for m, p in enumerate(probs[:-1]):
+        cumulative += p
+        if draw < cumulative:
+            return m
+    return len(probs) - 1
+
+
+def class_mode_counts(group, modes):
+    # (class, mode) table of how many agents chose each mode
+    counts = np.bincount(
+        group.astype(np.intp) * len(MODES) + modes,
+        minlength=len(CLASSES) * len(MODES),
+    )
+    return counts.reshape(len(CLASSES), len(MODES))
+
+
+def multinomial_counts(n, probs, rng=np.random):
+    # One multinomial draw per row (n[i] trials over probs[i]) via conditional binomials
+    draws = np.zeros(probs.shape, dtype=np.int64)
+    remaining = np.asarray(n, dtype=np.int64).copy()
+    left = np.ones(len(probs))
+    for m in range(probs.shape[1] - 1):
+        p = np.clip(probs[:, m] / np.maximum(left, 1e-300), 0.0, 1.0)
+        draws[:, m] = rng.binomial(remaining, p)
+        remaining -= draws[:, m]
+        left -= probs[:, m]
+    draws[:, -1] = remaining
+    return draws
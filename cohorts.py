@@ -0,0 +1,31 @@
+import numpy as np
+
+# Cohort approximation of the population: agents sharing a socio group, car
+# ownership, income bin and distance bin are simulated as one weighted row.
+INCOME_BINS = 32
+DISTANCE_BINS = 16
+STREAK_BUCKETS = 60                # streaks at or above the last bucket share it
+
+
+def quantile_bins(values, bins):
+    # Bin index per value using (roughly) equal-count bins
+    edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1]))
+    return np.searchsorted(edges, values, side="right")
+
+
+def build_cohorts(income, distance, car_owner, group, income_bins=INCOME_BINS, distance_bins=DISTANCE_BINS):
+    income_bin = quantile_bins(np.log(income), income_bins)
+    distance_bin = quantile_bins(np.log(distance), distance_bins)
+    keys = ((group.astype(np.int64) * 2 + car_owner) * income_bins + income_bin) * distance_bins + distance_bin
+    keys, inverse = np.unique(keys, return_inverse=True)
+
+    weight = np.bincount(inverse)
+    cohorts = {
+        "weight": weight,
+        # Cohort representatives are the within-cohort means
+        "income": np.bincount(inverse, weights=income) / weight,
+        "distance": np.bincount(inverse, weights=distance) / weight,
+        "car_owner": (keys // (income_bins * distance_bins)) % 2 == 1,
+        "group": (keys // (2 * income_bins * distance_bins)).astype(np.int8),
+    }
+    return cohorts, inverse
@@ -0,0 +1,238 @@
+import numpy as np
+from choice import CAR, CLASSES, MODES, utility_matrix
+from cohorts import DISTANCE_BINS, INCOME_BINS, STREAK_BUCKETS, build_cohorts
+
+# Expected congestion and mode shares computed from choice probabilities, without
+# stochastic simulation.
+#
+# expected_run is the entry point for screening policies: it follows a run month by month,
+# carrying the habit streak distribution forward from streak 0 and switching from the
+# initial policy to the new one after policy_step, as TransportModel.step does, and reports
+# the shares and congestion a run of that length should show.
+#
+# solve_equilibrium is an approximation kept for comparison: the stationary state with
+# streaks capped at streak_buckets (as the cohort engine does). The habit bonus grows with
+# the streak without bound, so the untruncated model has no steady state and the answer is
+# an artifact of the cap: car share and congestion rise with it, and runs of a few dozen
+# months stay well below the 60-bucket default. Its results are labelled as such and report
+# the same solve at twice the buckets ("streak_sensitivity").
+
+
+def model_cohorts(model, cohort_bins=(INCOME_BINS, DISTANCE_BINS)):
+    if getattr(model, "cohorts", None) is not None:
+        return model.cohorts
+    income_bins, distance_bins = cohort_bins
+    cohorts, _ = build_cohorts(
+        model.incomes, model.distances, model.car_ownerships, model.group_codes,
+        income_bins=income_bins, distance_bins=distance_bins,
+    )
+    return cohorts
+
+
+def stationary_streak_weights(p_car):
+    # Stationary distribution of the car habit streak for each row of p_car (rows x buckets):
+    # driving moves the streak up one bucket, anything else resets it, and the last bucket absorbs.
+    # The habit bonus grows without bound, so the bucket count (as in the cohort engine) is what
+    # makes a steady state exist; more buckets means a longer effective horizon.
+    weights = np.ones(p_car.shape)
+    weights[:, 1:] = np.cumprod(p_car[:, :-1], axis=1)
+    weights[:, -1] /= np.maximum(1.0 - p_car[:, -1], 1e-12)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def expected_mode_probabilities(model, cohorts, congestion_level, car_toll, fare_discount,
+                                streak_buckets=STREAK_BUCKETS):
+    # (cohort, mode) choice probabilities averaged over each cohort's stationary streak distribution
+    num_cohorts = len(cohorts["weight"])
+    c = np.repeat(np.arange(num_cohorts), streak_buckets)
+    s = np.tile(np.arange(streak_buckets), num_cohorts)
+    utilities = utility_matrix(
+        model,
+        cohorts["income"][c],
+        cohorts["distance"][c],
+        cohorts["car_owner"][c],
+        cohorts["group"][c],
+        s,
+        congestion_level=congestion_level,
+        car_toll=car_toll,
+        fare_discount=fare_discount,
+    )
+    probs = model.mode_probabilities(utilities).reshape(num_cohorts, streak_buckets, len(MODES))
+    weights = stationary_streak_weights(probs[:, :, CAR])
+    return np.einsum("cs,csm->cm", weights, probs)
+
+
+def expected_share_path(model, months, car_toll=None, fare_discount=None,
+                        cohort_bins=(INCOME_BINS, DISTANCE_BINS)):
+    # Expected (cohort, mode) counts for months 1..months of a fresh run, without the
+    # stationary assumption: everyone starts at streak 0 and the initial congestion level, the
+    # streak distribution is carried forward month by month (drivers move up one streak, the
+    # rest reset) and each month's congestion follows the expected number of drivers in the
+    # month before, as in TransportModel.step. Months up to policy_step use the initial toll
+    # and fare discount; later months add car_toll to the initial toll and use fare_discount
+    # (both default to the model's new policy). Streaks cannot exceed the month, so nothing is
+    # truncated. Returns the cohorts, the per-month counts and the congestion level each
+    # month's choices produced (the congestion_level a run reports for that step).
+    if car_toll is None:
+        car_toll = model.new_car_toll
+    if fare_discount is None:
+        fare_discount = model.new_fare_discount
+    cohorts = model_cohorts(model, cohort_bins)
+    num_cohorts = len(cohorts["weight"])
+    mass = cohorts["weight"][:, None].astype(float)        # (cohort, streak) agent counts
+    congestion_level = model.base_congestion_level
+    counts, congestion = [], []
+    for month in range(1, months + 1):
+        if month <= model.policy_step:
+            toll, discount = model.initial_car_toll, model.initial_fare_discount
+        else:
+            toll, discount = model.initial_car_toll + car_toll, fare_discount
+        c = np.repeat(np.arange(num_cohorts), month)
+        s = np.tile(np.arange(month), num_cohorts)
+        utilities = utility_matrix(
+            model,
+            cohorts["income"][c],
+            cohorts["distance"][c],
+            cohorts["car_owner"][c],
+            cohorts["group"][c],
+            s,
+            congestion_level=congestion_level,
+            car_toll=toll,
+            fare_discount=discount,
+        )
+        probs = model.mode_probabilities(utilities).reshape(num_cohorts, month, len(MODES))
+        counts.append(np.einsum("cs,csm->cm", mass, probs))
+        drivers = mass * probs[:, :, CAR]
+        mass = np.concatenate([(mass - drivers).sum(axis=1, keepdims=True), drivers], axis=1)
+        congestion_level = 1 + 0.15 * (counts[-1][:, CAR].sum() / model.road_capacity) ** 4
+        congestion.append(congestion_level)
+    return cohorts, counts, congestion
+
+
+def add_shares(result, model, cohorts, counts):
+    # {mode}_share_pct and {mode}_share_pct_{group} entries from (cohort, mode) counts
+    total = counts.sum(axis=0)
+    for m, mode in enumerate(MODES):
+        result[f"{mode}_share_pct"] = total[m] / model.num_agents * 100
+    for g, group in enumerate(CLASSES):
+        in_group = counts[cohorts["group"] == g]
+        group_total = in_group.sum()
+        for m, mode in enumerate(MODES):
+            result[f"{mode}_share_pct_{group}"] = in_group[:, m].sum() / group_total * 100
+    return result
+
+
+def expected_run(model, months=24, car_toll=None, fare_discount=None,
+                 cohort_bins=(INCOME_BINS, DISTANCE_BINS)):
+    # What a run of `months` steps with this policy should report at its last step (shares
+    # and congestion level, as solve_equilibrium reports them), plus the monthly car share
+    # and congestion paths. car_toll and fare_discount default to the model's new policy.
+    if car_toll is None:
+        car_toll = model.new_car_toll
+    if fare_discount is None:
+        fare_discount = model.new_fare_discount
+    cohorts, counts, congestion = expected_share_path(model, months, car_toll, fare_discount, cohort_bins)
+    result = {
+        "kind": "expected_run",
+        "car_toll": car_toll,
+        "fare_discount": fare_discount,
+        "months": months,
+        "congestion_level": congestion[-1],
+        "car_share_path": [month[:, CAR].sum() / model.num_agents * 100 for month in counts],
+        "congestion_path": congestion,
+    }
+    return add_shares(result, model, cohorts, counts[-1])
+
+
+def solve_equilibrium(
+    model,
+    car_toll=None,
+    fare_discount=None,
+    method="newton",
+    damping=0.5,
+    tol=1e-10,
+    max_iter=100,
+    streak_buckets=STREAK_BUCKETS,
+    cohort_bins=(INCOME_BINS, DISTANCE_BINS),
+    check_truncation=True,
+):
+    # Truncated stationary approximation (see above); use expected_run to screen policies.
+    # car_toll and fare_discount are the policy arguments TransportModel takes (toll on top of
+    # the initial toll); they default to the model's post-policy values. check_truncation
+    # adds the 2 x streak_buckets solve to the result.
+    if method not in ("newton", "damped"):
+        raise ValueError(f"unknown method {method!r}, expected 'newton' or 'damped'")
+    if car_toll is None:
+        car_toll = model.new_car_toll
+    if fare_discount is None:
+        fare_discount = model.new_fare_discount
+    toll = model.initial_car_toll + car_toll
+    cohorts = model_cohorts(model, cohort_bins)
+
+    def shares_at(congestion_level):
+        probs = expected_mode_probabilities(
+            model, cohorts, congestion_level, toll, fare_discount, streak_buckets
+        )
+        return probs * cohorts["weight"][:, None]
+
+    def update(congestion_level):
+        # Congestion implied by the expected number of drivers (same BPR form as update_congestion)
+        cars = shares_at(congestion_level)[:, CAR].sum()
+        return 1 + 0.15 * (cars / model.road_capacity) ** 4
+
+    # update() is decreasing in congestion, so the fixed point lies in [1, update(1)]
+    low, high = 1.0, update(1.0)
+    congestion_level = model.congestion_level if low <= model.congestion_level <= high else high
+    history = []
+    converged = False
+    for iteration in range(1, max_iter + 1):
+        implied = update(congestion_level)
+        residual = congestion_level - implied
+        history.append((congestion_level, residual))
+        if abs(residual) < tol:
+            converged = True
+            break
+        if method == "damped":
+            congestion_level = (1 - damping) * congestion_level + damping * implied
+            continue
+
+        # Safeguarded Newton on residual(c) = c - update(c), falling back to bisection
+        if residual < 0:
+            low = congestion_level
+        else:
+            high = congestion_level
+        step = 1e-6 * max(1.0, congestion_level)
+        slope = 1 - (update(congestion_level + step) - implied) / step
+        candidate = congestion_level - residual / slope if slope > 0 else None
+        if candidate is None or not low < candidate < high:
+            candidate = 0.5 * (low + high)
+        congestion_level = candidate
+
+    counts = shares_at(congestion_level)
+    result = {
+        "kind": "truncated_stationary_approximation",
+        "car_toll": car_toll,
+        "fare_discount": fare_discount,
+        "congestion_level": congestion_level,
+        "converged": converged,
+        "iterations": iteration,
+        "residual": abs(congestion_level - update(congestion_level)),
+        "method": method,
+        "history": history,
+        "streak_buckets": streak_buckets,
+    }
+    add_shares(result, model, cohorts, counts)
+
+    if check_truncation:
+        deeper = solve_equilibrium(
+            model, car_toll, fare_discount, method, damping, tol, max_iter,
+            2 * streak_buckets, cohort_bins, check_truncation=False,
+        )
+        result["streak_sensitivity"] = {
+            "streak_buckets": deeper["streak_buckets"],
+            "car_share_pct": deeper["car_share_pct"],
+            "congestion_level": deeper["congestion_level"],
+            "car_share_pct_change": deeper["car_share_pct"] - result["car_share_pct"],
+            "congestion_level_change": deeper["congestion_level"] - result["congestion_level"],
+        }
+    return result
@@ -0,0 +1,134 @@
+import numpy as np
+from scipy.optimize import minimize
+from choice import MODES, NEST_INDEX
+
+# Nested-logit estimation over whole observation arrays. Utilities are
+#     V = base_utilities + attributes @ beta
+# with base_utilities (n_obs, modes), optional attributes (n_obs, modes, k) and
+# parameters [beta..., lambda_private, lambda_public]. Unavailable modes carry -inf
+# base utility (e.g. car for agents without one).
+NEST_NAMES = list(NEST_INDEX)
+LAMBDA_BOUNDS = (0.05, 5.0)
+
+
+def choice_codes(choices):
+    choices = np.asarray(choices)
+    if choices.dtype.kind in "iu":
+        return choices.astype(np.intp)
+    return np.array([MODES.index(c) for c in choices], dtype=np.intp)
+
+
+def nested_logit_log_likelihood(params, base_utilities, choices, attributes=None):
+    # Returns (log-likelihood, gradient, per-observation gradients)
+    num_beta = 0 if attributes is None else attributes.shape[2]
+    beta, lambdas = params[:num_beta], params[num_beta:]
+    utilities = base_utilities if attributes is None else base_utilities + attributes @ beta
+    available = np.isfinite(utilities)
+    n = len(utilities)
+    rows = np.arange(n)
+
+    inclusive = np.empty((n, len(NEST_NAMES)))
+    conditional = np.zeros(utilities.shape)
+    for k, members in enumerate(NEST_INDEX.values()):
+        scaled = utilities[:, members] / lambdas[k]
+        top = scaled.max(axis=1, keepdims=True)
+        exp_scaled = np.exp(scaled - top)
+        total = exp_scaled.sum(axis=1, keepdims=True)
+        conditional[:, members] = exp_scaled / total
+        inclusive[:, k] = top[:, 0] + np.log(total[:, 0])
+    nest_utilities = lambdas * inclusive
+    top = nest_utilities.max(axis=1, keepdims=True)
+    log_denominator = top[:, 0] + np.log(np.exp(nest_utilities - top).sum(axis=1))
+    nest_probs = np.exp(nest_utilities - log_denominator[:, None])
+
+    nest_of = np.empty(len(MODES), dtype=np.intp)
+    for k, members in enumerate(NEST_INDEX.values()):
+        nest_of[members] = k
+    chosen_nest = nest_of[choices]
+    chosen_lambda = lambdas[chosen_nest]
+    chosen_utility = utilities[rows, choices]
+    chosen_inclusive = inclusive[rows, chosen_nest]
+    log_probs = (
+        chosen_utility / chosen_lambda
+        + (chosen_lambda - 1) * chosen_inclusive
+        - log_denominator
+    )
+
+    # Within-nest expected utility (unavailable modes have zero weight)
+    finite_utilities = np.where(available, utilities, 0.0)
+    mean_utility = np.empty((n, len(NEST_NAMES)))
+    for k, members in enumerate(NEST_INDEX.values()):
+        mean_utility[:, k] = (conditional[:, members] * finite_utilities[:, members]).sum(axis=1)
+
+    scores = np.zeros((n, len(params)))
+    for k in range(len(NEST_NAMES)):
+        lam = lambdas[k]
+        in_nest = chosen_nest == k
+        own = np.where(
+            in_nest,
+            -chosen_utility / lam**2 + inclusive[:, k] - (lam - 1) * mean_utility[:, k] / lam**2,
+            0.0,
+        )
+        scores[:, num_beta + k] = own - nest_probs[:, k] * (inclusive[:, k] - mean_utility[:, k] / lam)
+
+    if num_beta:
+        mean_attributes = np.empty((n, len(NEST_NAMES), num_beta))
+        for k, members in enumerate(NEST_INDEX.values()):
+            mean_attributes[:, k] = np.einsum("nj,njk->nk", conditional[:, members], attributes[:, members])
+        chosen_attributes = attributes[rows, choices]
+        own_mean = mean_attributes[rows, chosen_nest]
+        scores[:, :num_beta] = (
+            chosen_attributes / chosen_lambda[:, None]
+            + ((chosen_lambda - 1) / chosen_lambda)[:, None] * own_mean
+            - np.einsum("nk,nkb->nb", nest_probs, mean_attributes)
+        )
+
+    return log_probs.sum(), scores.sum(axis=0), scores
+
+
+def fit_nested_logit(base_utilities, choices, attributes=None, x0=None, lambda_bounds=LAMBDA_BOUNDS):
+    base_utilities = np.asarray(base_utilities, dtype=float)
+    choices = choice_codes(choices)
+    num_beta = 0 if attributes is None else attributes.shape[2]
+    if x0 is None:
+        x0 = np.concatenate([np.zeros(num_beta), [1.0, 1.0]])
+    bounds = [(None, None)] * num_beta + [lambda_bounds] * len(NEST_NAMES)
+
+    def objective(params):
+        log_likelihood, gradient, _ = nested_logit_log_likelihood(params, base_utilities, choices, attributes)
+        return -log_likelihood, -gradient
+
+    result = minimize(objective, x0, jac=True, method="L-BFGS-B", bounds=bounds)
+    params = result.x
+
+    # Standard errors from the inverse Hessian, itself a central difference of the analytic gradient
+    hessian = np.empty((len(params), len(params)))
+    for p in range(len(params)):
+        step = 1e-5 * max(1.0, abs(params[p]))
+        up, down = params.copy(), params.copy()
+        up[p] += step
+        down[p] -= step
+        hessian[:, p] = (
+            nested_logit_log_likelihood(up, base_utilities, choices, attributes)[1]
+            - nested_logit_log_likelihood(down, base_utilities, choices, attributes)[1]
+        ) / (2 * step)
+    hessian = 0.5 * (hessian + hessian.T)
+    try:
+        covariance = np.linalg.inv(-hessian)
+        std_errors = np.sqrt(np.maximum(np.diag(covariance), 0.0))
+    except np.linalg.LinAlgError:
+        covariance = None
+        std_errors = np.full(len(params), np.nan)
+
+    return {
+        "lambda_private": params[num_beta],
+        "lambda_public": params[num_beta + 1],
+        "beta": params[:num_beta],
+        "params": params,
+        "std_errors": std_errors,
+        "covariance": covariance,
+        "log_likelihood": -result.fun,
+        "converged": result.success,
+        "iterations": result.nit,
+        "num_observations": len(choices),
+    }
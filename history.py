@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+from choice import CLASSES, MODES
+
+NO_MODE = -1                       # agent has not chosen a mode yet
+MODE_CODES = {mode: m for m, mode in enumerate(MODES)}
+MODE_CODES[None] = NO_MODE
+MODE_LABELS = np.array(MODES + [None], dtype=object)   # code -1 maps to None
+
+
+class ModeHistory:
+    # Agent-level mode choices stored as int8 codes in a steps x agents array,
+    # plus per-step (class, from mode, to mode) transition counts for the full population.
+
+    def __init__(self, agent_ids, groups, sample=None, max_steps=None, path=None, rng=None):
+        num_agents = len(agent_ids)
+        if sample is None:
+            self.index = np.arange(num_agents)
+        else:
+            size = int(round(sample * num_agents)) if isinstance(sample, float) else int(sample)
+            size = min(max(size, 0), num_agents)
+            rng = np.random.default_rng() if rng is None else rng
+            self.index = np.sort(rng.choice(num_agents, size=size, replace=False))
+        self.agent_ids = np.asarray(agent_ids)[self.index]
+        self.groups = np.asarray(groups, dtype=np.intp)
+        self.path = path
+
+        capacity = max_steps if max_steps is not None else 64
+        if path is not None:
+            if max_steps is None:
+                raise ValueError("a memory-mapped history needs max_steps")
+            self.codes = np.lib.format.open_memmap(
+                path, mode="w+", dtype=np.int8, shape=(max_steps, len(self.index))
+            )
+        else:
+            self.codes = np.empty((capacity, len(self.index)), dtype=np.int8)
+        self.transitions = np.zeros((capacity, len(CLASSES), len(MODES), len(MODES)), dtype=np.int64)
+        self.steps = []
+        self.previous = None
+
+    def __len__(self):
+        return len(self.steps)
+
+    def _grow(self):
+        if self.path is not None:
+            raise IndexError(f"history is full ({len(self.codes)} steps)")
+        capacity = 2 * len(self.codes)
+        codes = np.empty((capacity, self.codes.shape[1]), dtype=np.int8)
+        codes[:len(self.steps)] = self.codes[:len(self.steps)]
+        transitions = np.zeros((capacity,) + self.transitions.shape[1:], dtype=np.int64)
+        transitions[:len(self.steps)] = self.transitions[:len(self.steps)]
+        self.codes, self.transitions = codes, transitions
+
+    def record(self, step, modes):
+        # modes holds the current int8 mode code of every agent in the population
+        row = len(self.steps)
+        if row == len(self.codes):
+            self._grow()
+        self.codes[row] = modes[self.index]
+
+        if self.previous is not None:
+            chosen = self.previous != NO_MODE
+            keys = (self.groups[chosen] * len(MODES) + self.previous[chosen]) * len(MODES) + modes[chosen]
+            counts = np.bincount(keys, minlength=self.transitions[row].size)
+            self.transitions[row] = counts.reshape(self.transitions.shape[1:])
+        self.previous = np.array(modes, dtype=np.intp)
+        self.steps.append(step)
+
+    def snapshot(self):
+        return len(self.steps), None if self.previous is None else self.previous.copy()
+
+    def restore(self, state):
+        # Rows past the snapshot are dropped and overwritten by later records
+        length, previous = state
+        del self.steps[length:]
+        self.previous = None if previous is None else previous.copy()
+
+    def mode_codes(self):
+        return self.codes[:len(self.steps)]
+
+    def transition_matrix(self, step, socio_group=None):
+        # (class, from mode, to mode) counts for the transition into `step`;
+        # with socio_group, just that class's from x to matrix
+        matrix = self.transitions[self.steps.index(step)]
+        if socio_group is not None:
+            return matrix[CLASSES.index(socio_group)]
+        return matrix
+
+    def get_transitions_dataframe(self):
+        num_steps = len(self.steps)
+        shape = self.transitions.shape[1:]
+        g, f, t = np.unravel_index(np.arange(np.prod(shape)), shape)
+        return pd.DataFrame({
+            "Step": np.repeat(self.steps, len(g)),
+            "socio_group": np.tile(np.array(CLASSES)[g], num_steps),
+            "from_mode": np.tile(np.array(MODES)[f], num_steps),
+            "to_mode": np.tile(np.array(MODES)[t], num_steps),
+            "count": self.transitions[:num_steps].reshape(-1),
+        })
+
+    def get_agent_vars_dataframe(self):
+        # Same layout as DataCollector.get_agent_vars_dataframe() with a mode_choice reporter
+        codes = self.mode_codes()
+        index = pd.MultiIndex.from_arrays(
+            [np.repeat(self.steps, len(self.agent_ids)), np.tile(self.agent_ids, len(self.steps))],
+            names=["Step", "AgentID"],
+        )
+        return pd.DataFrame({"mode_choice": MODE_LABELS[codes.reshape(-1)]}, index=index)
@@ -0,0 +1,69 @@
+import json
+import time
+import pandas as pd
+
+# Opt-in per-phase timing for TransportModel.step. The model calls start_step() and then
+# mark(phase) after each phase; every mark records the wall time since the previous one.
+# When a model has no profiler the step only pays a handful of `is not None` checks.
+PHASES = [
+    "agents",
+    "update_congestion",
+    "mode_share_pcts",
+    "congestion_costs",
+    "ghg_emissions",
+    "transit_costs",
+    "car_road_costs",
+    "policy",
+    "collect",
+    "history",
+]
+
+
+class StepProfiler:
+    # records holds one dict per step: "<phase>_seconds" for every phase, "total_seconds" and
+    # the counters (agents stepped, mode switches; None where the engine cannot tell). The
+    # callback, if any, receives each record as soon as its step finishes.
+
+    def __init__(self, callback=None, clock=time.perf_counter):
+        self.callback = callback
+        self.clock = clock
+        self.records = []
+        self.current = None
+        self.started = None
+        self.last = None
+
+    def start_step(self, step, **counters):
+        self.current = {"step": step, **counters}
+        self.started = self.last = self.clock()
+
+    def mark(self, phase):
+        now = self.clock()
+        self.current[f"{phase}_seconds"] = now - self.last
+        self.last = now
+
+    def end_step(self, **counters):
+        record = self.current
+        record.update(counters)
+        record["total_seconds"] = self.last - self.started
+        self.records.append(record)
+        self.current = None
+        if self.callback is not None:
+            self.callback(record)
+        return record
+
+    def to_frame(self):
+        return pd.DataFrame(self.records)
+
+    def summary(self):
+        # Mean and total seconds per phase over all recorded steps
+        frame = self.to_frame()
+        columns = [f"{phase}_seconds" for phase in PHASES if f"{phase}_seconds" in frame] + ["total_seconds"]
+        return frame[columns].agg(["mean", "sum"]).T
+
+    def save(self, path):
+        # CSV or JSON, chosen by the file extension
+        if str(path).endswith(".json"):
+            with open(path, "w") as f:
+                json.dump(self.records, f, indent=2)
+        else:
+            self.to_frame().to_csv(path, index=False)
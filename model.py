@@ -1,9 +1,48 @@
 from agent import CommuterAgent
+from choice import (
+    BUS, CAR, CLASSES, MODES, TIME_PER_MILE_ARRAY, choice_probabilities, class_mode_counts,
+    multinomial_counts, nested_logit_probabilities, sample_choices, utility_constant_table, utility_matrix,
+)
+import os
+import weakref
 import pandas as pd
 import numpy as np
 from mesa import Model
 from mesa.datacollection import DataCollector
-from scipy.optimize import root_scalar
+from cohorts import DISTANCE_BINS, INCOME_BINS, STREAK_BUCKETS, build_cohorts
+from history import MODE_CODES, NO_MODE, ModeHistory
+from instrumentation import StepProfiler
+from network import RoadNetwork
+from population import CHUNK_SIZE, cached_population
+from shards import ShardPool
+from steady_state import SteadyStateDetector
+from sinks import ReporterSink
+from streams import COHORT_CHOICE, MODE_CHOICE, stream_generator, stream_seed, uniforms
+
+# Model-level reporters collected every step
+MODEL_REPORTERS = [
+    "congestion_level",
+    "car_share_pct",
+    "bus_share_pct",
+    "train_share_pct",
+    "bike_walk_share_pct",
+
+    "car_share_pct_upper",
+    "bus_share_pct_upper",
+    "train_share_pct_upper",
+    "bike_walk_share_pct_upper",
+    "car_share_pct_middle",
+    "bus_share_pct_middle",
+    "train_share_pct_middle",
+    "bike_walk_share_pct_middle",
+    "car_share_pct_lower",
+    "bus_share_pct_lower",
+    "train_share_pct_lower",
+    "bike_walk_share_pct_lower",
+    "total_ghg",
+    "total_ghg_sum",
+    "total_system_profit",
+]
 
 
 class TransportModel(Model):
@@ -38,10 +77,27 @@ class TransportModel(Model):
         commute_distance_sigma = 0.5,
         width=10, 
         height=10, 
-        seed = None
+        seed = None,
+        engine = "agents",
+        history_sample = None,
+        history_steps = None,
+        history_path = None,
+        cohort_bins = (INCOME_BINS, DISTANCE_BINS),
+        cohort_streak_buckets = STREAK_BUCKETS,
+        population_cache = None,
+        choice_model = "logit",
+        utility_constants = None,
+        profiler = None,
+        shards = None,
+        sink = None,
+        network = None,
+        steady_state = None,
     ):
         
         super().__init__(seed=seed)
+        if engine not in ("agents", "vectorized", "sharded", "cohort"):
+            raise ValueError(f"unknown engine {engine!r}, expected 'agents', 'vectorized', 'sharded' or 'cohort'")
+        self.engine = engine                           # "agents" (Mesa objects), "vectorized" (arrays), "sharded" (arrays across processes) or "cohort" (weighted bins)
         self.num_agents = num_agents
         self.initial_car_toll = 9.2               # initial toll, e.g., 0.0
         self.initial_fare_discount = 0.0               # always zero at start
@@ -60,9 +116,17 @@ class TransportModel(Model):
 
         self.lambda_private = lambda_private
         self.lambda_public = lambda_public
+        if choice_model not in ("logit", "nested"):
+            raise ValueError(f"unknown choice_model {choice_model!r}, expected 'logit' or 'nested'")
+        self.choice_model = choice_model               # "nested" uses lambda_private / lambda_public
 
         self.road_capacity = road_capacity
         self.congestion_level = 1.3
+        self.base_congestion_level = self.congestion_level   # baseline for commute time deltas
+        self.base_car_toll = self.car_toll                   # baseline for car cost deltas
+        # ASCs per socio group, derived from income_mode_shares unless given (e.g. calibrated)
+        self.utility_constants = {group: {} for group in CLASSES}
+        self.set_utility_constants(utility_constant_table() if utility_constants is None else utility_constants)
         self.v_over_c = ((self.congestion_level - 1) / 0.15) ** (1/4)
         self.road_capacity = (self.num_agents * 0.5) / self.v_over_c
         self.median_income = median_income
@@ -117,26 +181,26 @@ class TransportModel(Model):
         self.train_share_pct_lower = 0
         self.bike_walk_share_pct_lower = 0
 
-        #incomes
-        self.socio_groups = []
-        def objective(alpha):
-            xm = mean_income * (alpha - 1) / alpha
-            return xm * 2**(1 / alpha) - median_income
+        #incomes, car ownership, socio groups and commute distances. All simulation randomness
+        #comes from counter-based streams keyed by stream_seed (see streams.py), so loading the
+        #population from population_cache (a directory) leaves every other draw unchanged.
+        self.stream_seed = stream_seed(seed)
+        self.alpha, population = cached_population(
+            self.num_agents, median_income, mean_income, seed, self.stream_seed, population_cache
+        )
+        self.incomes = population["income"]
+        self.car_ownerships = population["car_owner"]
+        self.group_codes = population["group"]
+        self.distances = population["distance"]
+        self.sensitivities = self.median_income / self.incomes
+        self.time_values = 0.5 * (self.incomes / 2080)
 
-        result = root_scalar(objective, bracket=[1.01, 10], method='brentq')
-        self.alpha = result.root
-        xm = mean_income * (self.alpha - 1) / self.alpha
-        self.incomes = xm * (1 + np.random.pareto(self.alpha, size=self.num_agents))
+        group_sizes = np.bincount(self.group_codes, minlength=len(CLASSES))
+        self.upper = int(group_sizes[CLASSES.index("upper")])
+        self.middle = int(group_sizes[CLASSES.index("middle")])
+        self.lower = int(group_sizes[CLASSES.index("lower")])
 
-        self.car_ownerships = []
-        self.sensitivities = []
-        self.time_values = []
-        
-        self.upper = 0
-        self.middle = 0
-        self.lower = 0
-        
-        self.car_owners = 0
+        self.car_owners = int(self.car_ownerships.sum())
         
         self.avg_freeflow_duration = avg_freeflow_duration
         self.total_freeflow_hours = 0
@@ -185,96 +249,346 @@ class TransportModel(Model):
         self.road_maintainence = 0
         self.toll_revenue = 0
         self.toll_profit = 0
+        self.corridor_toll_revenue = 0.0
         self.total_system_profit = 0
         
         self.commute_distance_mean = commute_distance_mean
         self.commute_distance_sigma = commute_distance_sigma
-        self.distances = []
-        for income in self.incomes:
-            self.sensitivities.append(self.median_income/income)
-            hourly_wage = income / 2080
-            self.time_values.append(0.5*hourly_wage)
-            prob = 1 / (1 + np.exp(-(-10 + 0.0002 * income)))
-            random_draw = np.random.rand(*np.shape(prob))
-            ownership = random_draw < prob
-            if(ownership):
-                self.car_owners+=1
-            self.car_ownerships.append(ownership)
-            if(income < 0.75 * self.median_income):
-                self.socio_groups.append("lower")
-                self.distances.append(np.random.lognormal(mean=2.0, sigma=0.4))
-                self.lower+=1
-            elif(income > 2 * self.median_income):
-                self.socio_groups.append("upper")
-                self.distances.append(np.random.lognormal(mean=2.3, sigma=0.5))
-                self.upper+=1
-            else:
-                self.socio_groups.append("middle")
-                self.distances.append(np.random.lognormal(mean=2.6, sigma=0.5))
-                self.middle+=1
-            
-        # Batch-create agents
-        CommuterAgent.create_agents(
-            model=self,
-            n=num_agents,
-            socio_group=self.socio_groups,
-            income=self.incomes,
-            car_owner=self.car_ownerships,
-            price_sensitivity=self.sensitivities,
-            distance = self.distances,
-            time_value = self.time_values,
-        )
+
+        self.shard_pool = None
+        if self.engine == "vectorized":
+            # Struct-of-arrays population: one entry per agent, no Mesa agent objects
+            self.car_habit_streaks = np.zeros(self.num_agents, dtype=np.int32)
+            self.mode_codes = np.full(self.num_agents, -1, dtype=np.int8)
+            self.chunk_size = CHUNK_SIZE
+        elif self.engine == "sharded":
+            # The same arrays in shared memory, stepped by one worker per slice of agents
+            # (shards defaults to one per core). close() stops the workers.
+            self.shard_pool = ShardPool(self.num_agents, shards or os.cpu_count())
+            for name, array in self.shard_pool.arrays.items():
+                if hasattr(self, name):
+                    array[:] = getattr(self, name)
+                setattr(self, name, array)
+            self.car_habit_streaks[:] = 0
+            self.mode_codes[:] = -1
+            self.chunk_size = CHUNK_SIZE
+            weakref.finalize(self, self.shard_pool.close)
+        elif self.engine == "cohort":
+            # Weighted cohorts on an income x distance grid, split by group and ownership;
+            # cohort_counts[c, s] is how many members of cohort c have car habit streak s
+            income_bins, distance_bins = cohort_bins
+            self.cohorts, _ = build_cohorts(
+                self.incomes, self.distances, self.car_ownerships, self.group_codes,
+                income_bins=income_bins, distance_bins=distance_bins,
+            )
+            self.cohort_counts = np.zeros((len(self.cohorts["weight"]), cohort_streak_buckets), dtype=np.int64)
+            self.cohort_counts[:, 0] = self.cohorts["weight"]
+        else:
+            # Agents index into these per-agent arrays instead of keeping their own copies
+            self.values_of_time = 0.1 * 10.0 * (self.incomes / self.median_income)   # $/min
+            self.price_sensitivities = 0.1 * self.sensitivities
+            self.base_commute_times = self.distances[:, None] * (TIME_PER_MILE_ARRAY / 60.0)
+            self.base_commute_times[:, [CAR, BUS]] *= self.base_congestion_level
+            self.base_commute_costs = np.array([car_cost + self.base_car_toll, bus_cost, train_cost, 0.0])
+            self.base_commute_costs_list = self.base_commute_costs.tolist()
+            CommuterAgent.create_agents(model=self, n=num_agents, index=np.arange(num_agents))
+            self.agent_list = list(self.agents)
+
+        # Optional road network on the width x height grid (network.RoadNetwork options, or
+        # True for the defaults): per-route congestion and corridor tolls instead of one
+        # global road. Agent distances become their route lengths.
+        self.network = None
+        if network is not None and network is not False:
+            if self.engine != "vectorized":
+                raise ValueError("network mode needs engine='vectorized'")
+            self.network = RoadNetwork(width, height, **({} if network is True else dict(network)))
+            self.network.assign(self)
 
         self.datacollector = DataCollector(
-            model_reporters={
-                "congestion_level": "congestion_level",
-                "car_share_pct": "car_share_pct",
-                "bus_share_pct": "bus_share_pct",
-                "train_share_pct": "train_share_pct",
-                "bike_walk_share_pct": "bike_walk_share_pct",
-                
-                "car_share_pct_upper": "car_share_pct_upper",
-                "bus_share_pct_upper": "bus_share_pct_upper",
-                "train_share_pct_upper": "train_share_pct_upper",
-                "bike_walk_share_pct_upper": "bike_walk_share_pct_upper",
-                "car_share_pct_middle": "car_share_pct_middle",
-                "bus_share_pct_middle": "bus_share_pct_middle",
-                "train_share_pct_middle": "train_share_pct_middle",
-                "bike_walk_share_pct_middle": "bike_walk_share_pct_middle",
-                "car_share_pct_lower": "car_share_pct_lower",
-                "bus_share_pct_lower": "bus_share_pct_lower",
-                "train_share_pct_lower": "train_share_pct_lower",
-                "bike_walk_share_pct_lower": "bike_walk_share_pct_lower",
-                "total_ghg": "total_ghg",
-                "total_ghg_sum": "total_ghg_sum",
-                "total_system_profit": "total_system_profit",
-            },
-            agent_reporters={
-                "mode_choice": "mode_choice",
-            },
+            model_reporters={name: name for name in MODEL_REPORTERS},
         )
 
+        # Agent-level mode choices (int8 codes), optionally subsampled or memory-mapped.
+        # Cohorts do not track individual agents, so there is no history for them.
+        self.history = None
+        if self.engine != "cohort":
+            if self.engine in ("vectorized", "sharded"):
+                agent_ids = np.arange(1, self.num_agents + 1)
+            else:
+                agent_ids = np.array([a.unique_id for a in self.agent_list])
+            self.history = ModeHistory(
+                agent_ids,
+                self.group_codes,
+                sample=history_sample,
+                max_steps=history_steps,
+                path=history_path,
+                rng=self.rng,
+            )
+
+
+        # Optional per-phase timing (instrumentation.StepProfiler, or True for a fresh one)
+        self.profiler = StepProfiler() if profiler is True else profiler
+        # Optional streaming Parquet output (sinks.ReporterSink, or a dataset directory)
+        self.sink = ReporterSink(sink) if isinstance(sink, (str, os.PathLike)) else sink
+
+        # Optional early stopping once post-policy dynamics are steady (steady_state.py
+        # detector options, True for the defaults, or a SteadyStateDetector whose options
+        # are copied into a fresh detector)
+        if isinstance(steady_state, SteadyStateDetector):
+            steady_state = steady_state.options()
+        if steady_state is True:
+            steady_state = SteadyStateDetector()
+        elif isinstance(steady_state, dict):
+            steady_state = SteadyStateDetector(**steady_state)
+        self.steady_state = steady_state or None
+        self.stopped_step = 0                          # step the detector stopped the run at, 0 if it has not
 
         self.running = True
         # self.datacollector.collect(self)
         
     def step(self):
-        self.agents.shuffle_do("step")
+        profiler = self.profiler
+        if profiler is not None:
+            # Mode switches need the pre-step choices; cohorts do not track individual agents
+            previous_modes = None if self.engine == "cohort" else self.current_mode_codes().copy()
+            profiler.start_step(self.steps, agents_stepped=self.num_agents)
+        if self.engine == "vectorized":
+            self.step_vectorized()
+        elif self.engine == "sharded":
+            self.set_mode_counts(self.shard_pool.step(self))
+        elif self.engine == "cohort":
+            self.step_cohorts()
+        else:
+            self.step_agents()
+        if profiler is not None:
+            profiler.mark("agents")
         self.update_congestion()
+        if profiler is not None:
+            profiler.mark("update_congestion")
         self.total_bike_walk_count = self.mode_counts["bike_walk"]["upper"]+self.mode_counts["bike_walk"]["middle"]+self.mode_counts["bike_walk"]["lower"]
         self.mode_share_pcts()
+        if profiler is not None:
+            profiler.mark("mode_share_pcts")
         self.congestion_costs()
+        if profiler is not None:
+            profiler.mark("congestion_costs")
         self.ghg_emissions()
+        if profiler is not None:
+            profiler.mark("ghg_emissions")
         self.transit_costs()
+        if profiler is not None:
+            profiler.mark("transit_costs")
         self.car_road_costs()
+        if profiler is not None:
+            profiler.mark("car_road_costs")
         self.total_system_profit = self.toll_profit + self.total_transit_profit - self.total_cong_cost
         if self.steps == self.policy_step:
             self.car_toll += self.new_car_toll
             self.fare_discount = self.new_fare_discount
+        if profiler is not None:
+            profiler.mark("policy")
         self.datacollector.collect(self)
+        if self.sink is not None:
+            self.sink.record(self)
+        if profiler is not None:
+            profiler.mark("collect")
+        if self.history is not None:
+            self.history.record(self.steps, self.current_mode_codes())
+        if self.steady_state is not None and self.steady_state.update(self):
+            self.running = False
+            self.stopped_step = self.steps
+        if profiler is not None:
+            profiler.mark("history")
+            mode_switches = None
+            if previous_modes is not None:
+                # An agent's first choice is not a switch
+                current = self.current_mode_codes()
+                mode_switches = int(((previous_modes != current) & (previous_modes != NO_MODE)).sum())
+            profiler.end_step(mode_switches=mode_switches)
+
+    def set_policy(self, car_toll, fare_discount):
+        # Changes the policy a run switches to at policy_step; once that step has
+        # passed, the new policy takes effect immediately.
+        self.new_car_toll = car_toll
+        self.new_fare_discount = fare_discount
+        if self.steps >= self.policy_step:
+            self.car_toll = self.initial_car_toll + car_toll
+            self.fare_discount = fare_discount
+
+    def snapshot(self):
+        # Everything a run mutates after construction: scalar state, mode counts, per-agent
+        # habit streaks and modes, collected data lengths and RNG states. The population
+        # itself never changes, so a snapshot can only be restored into the model it came from.
+        state = {
+            "scalars": {
+                name: value for name, value in vars(self).items()
+                if not name.startswith("_") and isinstance(value, (bool, int, float, np.number))
+            },
+            "mode_counts": {mode: dict(counts) for mode, counts in self.mode_counts.items()},
+            "total_mode_counts": dict(self.total_mode_counts),
+            "model_vars_length": len(self.datacollector.model_vars[MODEL_REPORTERS[0]]),
+            "history": None if self.history is None else self.history.snapshot(),
+            "steady_state": None if self.steady_state is None else self.steady_state.snapshot(),
+            "np_random_state": np.random.get_state(),
+            "rng_state": self.rng.bit_generator.state,
+            "random_state": self.random.getstate(),
+        }
+        if self.engine in ("vectorized", "sharded"):
+            state["car_habit_streaks"] = self.car_habit_streaks.copy()
+            state["mode_codes"] = self.mode_codes.copy()
+            if self.network is not None:
+                state["network"] = {
+                    name: getattr(self.network, name).copy()
+                    for name in ("link_loads", "link_times", "route_congestion")
+                }
+        elif self.engine == "cohort":
+            state["cohort_counts"] = self.cohort_counts.copy()
+        else:
+            state["agents"] = [(a.car_habit_streak, a.mode_choice) for a in self.agent_list]
+        return state
+
+    def restore(self, state):
+        for name, value in state["scalars"].items():
+            setattr(self, name, value)
+        self.mode_counts = {mode: dict(counts) for mode, counts in state["mode_counts"].items()}
+        self.total_mode_counts = dict(state["total_mode_counts"])
+        length = state["model_vars_length"]
+        for name, values in self.datacollector.model_vars.items():
+            del values[length:]
+        if self.history is not None:
+            self.history.restore(state["history"])
+        if self.steady_state is not None:
+            self.steady_state.restore(state["steady_state"])
+        np.random.set_state(state["np_random_state"])
+        self.rng.bit_generator.state = state["rng_state"]
+        self.random.setstate(state["random_state"])
+
+        if self.engine in ("vectorized", "sharded"):
+            # In place: sharded workers see these arrays through shared memory
+            self.car_habit_streaks[:] = state["car_habit_streaks"]
+            self.mode_codes[:] = state["mode_codes"]
+            if self.network is not None:
+                for name, value in state["network"].items():
+                    setattr(self.network, name, value.copy())
+        elif self.engine == "cohort":
+            self.cohort_counts = state["cohort_counts"].copy()
+        else:
+            for agent, (streak, mode) in zip(self.agent_list, state["agents"]):
+                agent.car_habit_streak = streak
+                agent.mode_choice = mode
+
+    def close(self):
+        # Flushes the sink, stops sharded workers and frees their shared memory; the model
+        # keeps private copies of its arrays, so it can still be read afterwards
+        if self.sink is not None:
+            self.sink.close()
+        if self.shard_pool is not None:
+            for name in self.shard_pool.arrays:
+                setattr(self, name, getattr(self, name).copy())
+            self.shard_pool.close()
+            self.shard_pool = None
+
+    def current_mode_codes(self):
+        if self.engine in ("vectorized", "sharded"):
+            return self.mode_codes
+        return np.fromiter(
+            (MODE_CODES[a.mode_choice] for a in self.agent_list), dtype=np.int8, count=self.num_agents
+        )
+
+    def set_utility_constants(self, constants):
+        # constants is a {group: {mode: asc}} dict or a (class, mode) array. The per-group
+        # dicts are updated in place, so agents always read the current values.
+        if isinstance(constants, dict):
+            constants = np.array([[constants[g][m] for m in MODES] for g in CLASSES])
+        self.utility_constant_table = np.array(constants, dtype=float)
+        for g, group in enumerate(CLASSES):
+            self.utility_constants[group].update(zip(MODES, self.utility_constant_table[g].tolist()))
+
+    def mode_probabilities(self, utilities):
+        if self.choice_model == "nested":
+            return nested_logit_probabilities(utilities, self.lambda_private, self.lambda_public)
+        return choice_probabilities(utilities)
+
+    def step_agents(self):
+        # Each agent's uniform is addressed by (step, agent index), so the activation order
+        # does not change any choice and matches the vectorized engine's draws
+        self.choice_draws = uniforms(self.stream_seed, MODE_CHOICE, self.steps, 0, self.num_agents)
+        self.agents.shuffle_do("step")
+
+    def step_vectorized(self):
+        # Same decision rule as CommuterAgent.step, evaluated for all agents at once.
+        # Agents only read model state that is fixed during the step, so order does not matter.
+        for start in range(0, self.num_agents, self.chunk_size):
+            self.step_slice(start, min(start + self.chunk_size, self.num_agents))
+        self.set_mode_counts(class_mode_counts(self.group_codes, self.mode_codes))
+
+    def step_slice(self, start, stop):
+        # Chooses modes for agents start..stop-1; draws depend only on (step, agent index),
+        # so any partition of the population into slices gives the same result
+        chunk = slice(start, stop)
+        congestion_level = car_toll = None
+        if self.network is not None:
+            congestion_level, car_toll = self.network.agent_conditions(self, chunk)
+        utilities = utility_matrix(
+            self,
+            self.incomes[chunk],
+            self.distances[chunk],
+            self.car_ownerships[chunk],
+            self.group_codes[chunk],
+            self.car_habit_streaks[chunk],
+            congestion_level=congestion_level,
+            car_toll=car_toll,
+        )
+        draws = uniforms(self.stream_seed, MODE_CHOICE, self.steps, start, stop - start)
+        modes = sample_choices(self.mode_probabilities(utilities), draws)
+        self.mode_codes[chunk] = modes
+        streaks = self.car_habit_streaks[chunk]
+        self.car_habit_streaks[chunk] = np.where(modes == CAR, streaks + 1, 0)
+
+    def step_cohorts(self):
+        # One multinomial draw per occupied (cohort, streak bucket) instead of one draw per agent
+        cohorts = self.cohorts
+        c, s = np.nonzero(self.cohort_counts)
+        utilities = utility_matrix(
+            self,
+            cohorts["income"][c],
+            cohorts["distance"][c],
+            cohorts["car_owner"][c],
+            cohorts["group"][c],
+            s,
+        )
+        draws = multinomial_counts(
+            self.cohort_counts[c, s],
+            self.mode_probabilities(utilities),
+            rng=stream_generator(self.stream_seed, COHORT_CHOICE, self.steps),
+        )
+
+        # Drivers move up one streak bucket (capped at the last), everyone else resets to zero
+        counts = np.zeros_like(self.cohort_counts)
+        top = counts.shape[1] - 1
+        np.add.at(counts, (c, np.minimum(s + 1, top)), draws[:, CAR])
+        np.add.at(counts, (c, 0), draws.sum(axis=1) - draws[:, CAR])
+        self.cohort_counts = counts
+
+        groups = cohorts["group"][c]
+        class_counts = np.stack(
+            [np.bincount(groups, weights=draws[:, m], minlength=len(CLASSES)) for m in range(len(MODES))],
+            axis=1,
+        )
+        self.set_mode_counts(class_counts)
+
+    def set_mode_counts(self, counts):
+        # counts is a (class, mode) array in CLASSES x MODES order
+        for m, mode in enumerate(MODES):
+            for g, group in enumerate(CLASSES):
+                self.mode_counts[mode][group] = int(counts[g, m])
+            self.total_mode_counts[mode] = int(counts[:, m].sum())
 
     def update_congestion(self):
-        cars = sum(1 for a in self.agents if a.mode_choice == 'car')
+        if getattr(self, "network", None) is not None:
+            self.network.load(self)
+            return
+        cars = self.total_mode_counts["car"]
         self.v_over_c = cars / self.road_capacity
         self.congestion_level = 1 + 0.15 * (self.v_over_c) ** 4
     def mode_share_pcts(self):
@@ -323,6 +637,6 @@ class TransportModel(Model):
         self.total_transit_profit = self.total_transit_rev - self.total_transit_cost
     def car_road_costs(self):
         self.road_maintainence = self.road_maintainence_cost_car  * (self.total_freeflow_hours + self.car_congestion_hours) + self.road_maintainence_cost_truck * self.truck_congestion_hours
-        self.toll_revenue = self.total_mode_counts["car"] * self.car_toll
+        self.toll_revenue = self.total_mode_counts["car"] * self.car_toll + self.corridor_toll_revenue
         self.toll_profit = self.toll_revenue * (1 - self.car_enforcement_pct) - self.road_maintainence
     #def calculate_shares()
\ No newline at end of file
@@ -0,0 +1,171 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import dijkstra
+from choice import BUS, CAR, TIME_PER_MILE
+from streams import POPULATION_DESTINATION, POPULATION_ORIGIN, uniforms
+
+# Road network on the model's width x height grid. Cells are nodes and each pair of
+# neighbouring cells is joined by two directed links. Every agent gets an origin cell and a
+# destination cell whose grid distance matches their commute distance. Trips follow the
+# free-flow shortest path between them. The paths in use are precomputed as a sparse
+# (link, route) incidence matrix, so each step is a few bincounts and sparse mat-vecs:
+# route demand -> link loads -> BPR link times -> route congestion. Car and bus utilities
+# then use each agent's own route congestion instead of the global congestion level.
+BUS_OCCUPANCY = 40.0               # riders per bus
+BUS_PCE = 2.5                      # passenger-car equivalents per bus
+BPR_ALPHA = 0.15
+BPR_BETA = 4
+ROUTE_CHUNK = 256                  # origins per shortest-path batch
+STEPS = np.array([(1, 0), (-1, 0), (0, 1), (0, -1)])    # (dx, dy) of the four link directions
+
+
+def grid_links(width, height):
+    # Directed links between 4-neighbours: (from cell, to cell, direction) arrays, with
+    # cell = y * width + x; lookup[cell, direction] is the link leaving that way or -1
+    x, y = np.meshgrid(np.arange(width), np.arange(height))
+    x, y = x.ravel(), y.ravel()
+    sources, targets, directions = [], [], []
+    for d, (dx, dy) in enumerate(STEPS):
+        inside = (x + dx >= 0) & (x + dx < width) & (y + dy >= 0) & (y + dy < height)
+        sources.append((y * width + x)[inside])
+        targets.append(((y + dy) * width + x + dx)[inside])
+        directions.append(np.full(inside.sum(), d))
+    sources, targets, directions = map(np.concatenate, (sources, targets, directions))
+    lookup = np.full((width * height, len(STEPS)), -1, dtype=np.int64)
+    lookup[sources, directions] = np.arange(len(sources))
+    return sources, targets, lookup
+
+
+def trip_cells(num_agents, distances, width, height, cell_miles, seed):
+    # Origin and destination cells. The destination offset splits the agent's distance
+    # between the x and y directions with a random share and quadrant, then rounds to cells;
+    # offsets that would leave the grid are mirrored, then clipped.
+    u = uniforms(seed, POPULATION_ORIGIN, 0, 0, num_agents)
+    origins = np.minimum((u * width * height).astype(np.int64), width * height - 1)
+    ox, oy = origins % width, origins // width
+
+    cells = distances / cell_miles
+    share = uniforms(seed, POPULATION_DESTINATION, 0, 0, num_agents)
+    quadrant = (uniforms(seed, POPULATION_DESTINATION, 1, 0, num_agents) * 4).astype(np.int64)
+    dx = np.rint(cells * share) * np.where(quadrant & 1, -1, 1)
+    dy = np.rint(cells * (1 - share)) * np.where(quadrant & 2, -1, 1)
+    dx = np.where((ox + dx < 0) | (ox + dx >= width), -dx, dx)
+    dy = np.where((oy + dy < 0) | (oy + dy >= height), -dy, dy)
+    dx_cells = np.clip(ox + dx, 0, width - 1).astype(np.int64)
+    dy_cells = np.clip(oy + dy, 0, height - 1).astype(np.int64)
+    return origins, dy_cells * width + dx_cells
+
+
+class RoadNetwork:
+    # corridor_tolls is a list of (axis, index, toll): a toll in dollars per link on every
+    # link along grid row `index` ("row") or column `index` ("column"), charged to cars from
+    # the policy switch on, like car_toll
+
+    def __init__(self, width, height, cell_miles=2.0, corridor_tolls=()):
+        self.width = width
+        self.height = height
+        self.cell_miles = cell_miles
+        self.link_from, self.link_to, self.link_lookup = grid_links(width, height)
+        self.num_links = len(self.link_from)
+        self.link_miles = np.full(self.num_links, float(cell_miles))
+        self.freeflow_times = self.link_miles * TIME_PER_MILE["car"] / 60.0      # hours
+        self.link_tolls = np.zeros(self.num_links)
+        for axis, index, toll in corridor_tolls:
+            self.link_tolls[self.corridor_links(axis, index)] += toll
+
+    def corridor_links(self, axis, index):
+        # Links running along grid row (horizontal links with y == index) or column
+        fx, fy = self.link_from % self.width, self.link_from // self.width
+        tx, ty = self.link_to % self.width, self.link_to // self.width
+        if axis == "row":
+            return np.flatnonzero((fy == index) & (ty == index))
+        if axis == "column":
+            return np.flatnonzero((fx == index) & (tx == index))
+        raise ValueError(f"unknown corridor axis {axis!r}, expected 'row' or 'column'")
+
+    def route_incidence(self, origins, destinations):
+        # Sparse (link, route) incidence of the free-flow shortest paths for the given
+        # origin -> destination pairs, walked back from each destination all at once
+        graph = sparse.csr_matrix(
+            (self.freeflow_times, (self.link_from, self.link_to)), shape=(self.width * self.height,) * 2
+        )
+        rows, columns = [], []
+        sources = np.unique(origins)
+        for start in range(0, len(sources), ROUTE_CHUNK):
+            batch = sources[start:start + ROUTE_CHUNK]
+            _, predecessors = dijkstra(graph, indices=batch, return_predecessors=True)
+            routes = np.flatnonzero(np.isin(origins, batch))
+            source_row = np.searchsorted(batch, origins[routes])
+            current = destinations[routes].copy()
+            active = current != origins[routes]
+            while active.any():
+                r, node = routes[active], current[active]
+                previous = predecessors[source_row[active], node]
+                dx = node % self.width - previous % self.width
+                direction = np.select([dx == 1, dx == -1, node > previous], [0, 1, 2], 3)
+                rows.append(self.link_lookup[previous, direction])
+                columns.append(r)
+                current[active] = previous
+                active = current != origins[routes]
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        columns = np.concatenate(columns) if columns else np.empty(0, dtype=np.int64)
+        return sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, columns)), shape=(self.num_links, len(origins))
+        )
+
+    def assign(self, model):
+        # Gives every agent a route and sets the per-agent distances to the route length.
+        # Trips within one cell use no links and keep their sampled distance.
+        origins, destinations = trip_cells(
+            model.num_agents, model.distances, self.width, self.height, self.cell_miles, model.stream_seed
+        )
+        codes, self.agent_routes = np.unique(origins * self.width * self.height + destinations, return_inverse=True)
+        self.agent_routes = self.agent_routes.astype(np.int32)
+        self.route_origins = codes // (self.width * self.height)
+        self.route_destinations = codes % (self.width * self.height)
+        self.incidence = self.route_incidence(self.route_origins, self.route_destinations)
+        self.route_links = self.incidence.T.tocsr()            # (route, link), for route sums
+        self.num_routes = len(codes)
+        self.route_miles = self.route_links @ self.link_miles
+        self.route_freeflow_times = self.route_links @ self.freeflow_times
+        self.route_tolls = self.route_links @ self.link_tolls
+        self.intrazonal = self.route_origins == self.route_destinations
+        route_miles = self.route_miles[self.agent_routes]
+        model.distances = np.where(route_miles > 0, route_miles, model.distances)
+
+        # Link capacities mirror the scalar model's calibration: if half of all trips went
+        # by car, every link would be at the initial congestion level
+        trips = np.bincount(self.agent_routes, minlength=self.num_routes).astype(float)
+        self.capacities = np.maximum(0.5 * (self.incidence @ trips) / model.v_over_c, 1.0)
+        self.link_loads = np.zeros(self.num_links)
+        self.link_times = self.freeflow_times * model.congestion_level
+        self.route_congestion = np.full(self.num_routes, model.congestion_level)
+
+    def load(self, model):
+        # Loads the current car and bus trips onto the links and updates link times, route
+        # congestion and the model's network-wide congestion level (car hours / free-flow
+        # hours). Car totals are taken at the route level, so a step costs one incidence
+        # product each way.
+        modes = model.mode_codes
+        cars = np.bincount(self.agent_routes, weights=modes == CAR, minlength=self.num_routes)
+        riders = np.bincount(self.agent_routes, weights=modes == BUS, minlength=self.num_routes)
+        self.link_loads = self.incidence @ (cars + riders * (BUS_PCE / BUS_OCCUPANCY))
+        v_over_c = self.link_loads / self.capacities
+        self.link_times = self.freeflow_times * (1 + BPR_ALPHA * v_over_c ** BPR_BETA)
+        route_times = self.route_links @ self.link_times
+
+        freeflow = cars @ self.route_freeflow_times
+        model.congestion_level = (cars @ route_times) / freeflow if freeflow > 0 else 1.0
+        model.v_over_c = self.link_loads @ v_over_c / self.link_loads.sum() if self.link_loads.any() else 0.0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.route_congestion = route_times / self.route_freeflow_times
+        self.route_congestion[self.intrazonal] = model.congestion_level
+        model.corridor_toll_revenue = float(cars @ self.route_tolls) if model.steps > model.policy_step else 0.0
+
+    def agent_conditions(self, model, chunk):
+        # (congestion level, car toll) for agents in chunk, from their routes
+        routes = self.agent_routes[chunk]
+        car_toll = model.car_toll
+        if model.steps > model.policy_step:
+            car_toll = car_toll + self.route_tolls[routes]
+        return self.route_congestion[routes], car_toll
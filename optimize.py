@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+from sweep import iter_runs
+
+# Policy search over (car_toll, fare_discount): maximize an objective reporter subject to
+# an upper limit on a constraint reporter, both read at the end of the run. Each round
+# evaluates a grid over the current search box, adds replications only where the noise
+# matters (constraint uncertain, or objective tied with the incumbent), then shrinks the
+# box around the best feasible policy.
+
+
+def policy_grid(toll_bounds, discount_bounds, points):
+    return [
+        (float(toll), float(discount))
+        for toll in np.linspace(toll_bounds[0], toll_bounds[1], points)
+        for discount in np.linspace(discount_bounds[0], discount_bounds[1], points)
+    ]
+
+
+def pareto_frontier(summary, objective="objective_mean", constraint="constraint_mean"):
+    # Policies no other policy beats on both a lower constraint and a higher objective
+    ordered = summary.sort_values([constraint, objective], ascending=[True, False])
+    frontier, best = [], -np.inf
+    for index, row in ordered.iterrows():
+        if row[objective] > best:
+            frontier.append(index)
+            best = row[objective]
+    return summary.loc[frontier].reset_index(drop=True)
+
+
+def optimize_policy(
+    limit,
+    objective="total_system_profit",
+    constraint="total_ghg_sum",
+    toll_bounds=(0.0, 20.0),
+    discount_bounds=(0.0, 1.0),
+    model_params=None,
+    max_steps=24,
+    grid_points=4,
+    rounds=3,
+    replications=2,
+    max_replications=8,
+    z=1.96,
+    shrink=0.5,
+    seed=0,
+    processes=None,
+):
+    model_params = dict(model_params or {})
+    search_bounds = (toll_bounds, discount_bounds)
+    samples = {}             # (car_toll, fare_discount) -> list of (objective, constraint)
+    simulations = 0
+
+    def evaluate(requests):
+        # requests maps a policy to how many more replications it needs. Replication r always
+        # uses seed + r, so every policy sees the same populations and warm-ups.
+        nonlocal simulations
+        runs = []
+        for (toll, discount), extra in requests.items():
+            done = len(samples.get((toll, discount), []))
+            for r in range(done, done + extra):
+                kwargs = {**model_params, "car_toll": toll, "fare_discount": discount, "seed": seed + r}
+                runs.append((kwargs, r))
+        if not runs:
+            return
+        rows = []
+        for run_rows in iter_runs(
+            runs, max_steps, [objective, constraint], data_collection_period=max_steps,
+            processes=processes, fork_warmup=True,
+        ):
+            rows.extend(run_rows)
+        final = pd.DataFrame(rows).sort_values("Step").groupby(
+            ["car_toll", "fare_discount", "iteration"]
+        ).last().reset_index()
+        for row in final.itertuples(index=False):
+            key = (float(row.car_toll), float(row.fare_discount))
+            samples.setdefault(key, []).append((getattr(row, objective), getattr(row, constraint)))
+        simulations += len(runs)
+
+    def summarize():
+        records = []
+        for (toll, discount), values in samples.items():
+            values = np.array(values)
+            n = len(values)
+            mean = values.mean(axis=0)
+            se = values.std(axis=0, ddof=1) / np.sqrt(n) if n > 1 else np.full(2, np.inf)
+            if mean[1] + z * se[1] <= limit:
+                status = "feasible"
+            elif mean[1] - z * se[1] > limit:
+                status = "infeasible"
+            else:
+                status = "uncertain"
+            records.append({
+                "car_toll": toll,
+                "fare_discount": discount,
+                "replications": n,
+                "objective_mean": mean[0],
+                "objective_se": se[0],
+                "constraint_mean": mean[1],
+                "constraint_se": se[1],
+                "status": status,
+            })
+        return pd.DataFrame(records)
+
+    def incumbent(summary):
+        feasible = summary[summary["status"] == "feasible"]
+        if feasible.empty:
+            return None
+        return feasible.loc[feasible["objective_mean"].idxmax()]
+
+    for _ in range(rounds):
+        grid = policy_grid(toll_bounds, discount_bounds, grid_points)
+        evaluate({policy: replications for policy in grid if policy not in samples})
+
+        # Replicate where it can change the answer, until max_replications
+        while True:
+            summary = summarize()
+            best = incumbent(summary)
+            contested = summary["status"] == "uncertain"
+            if best is not None:
+                contested |= (summary["status"] == "feasible") & (
+                    summary["objective_mean"] + z * summary["objective_se"]
+                    >= best["objective_mean"] - z * best["objective_se"]
+                )
+            contested &= summary["replications"] < max_replications
+            if not contested.any():
+                break
+            evaluate({
+                (row.car_toll, row.fare_discount): min(replications, max_replications - row.replications)
+                for row in summary[contested].itertuples()
+            })
+
+        # Shrink the search box around the incumbent (or the least-violating policy)
+        center = best if best is not None else summary.loc[summary["constraint_mean"].idxmin()]
+        boxes = []
+        for bounds, value, full in zip(
+            (toll_bounds, discount_bounds), (center["car_toll"], center["fare_discount"]), search_bounds
+        ):
+            half = shrink * (bounds[1] - bounds[0]) / 2
+            boxes.append((max(full[0], value - half), min(full[1], value + half)))
+        toll_bounds, discount_bounds = boxes
+
+    summary = summarize()
+    best = incumbent(summary)
+    result = {
+        "feasible": best is not None,
+        "car_toll": None if best is None else best["car_toll"],
+        "fare_discount": None if best is None else best["fare_discount"],
+        "objective": objective,
+        "objective_mean": None if best is None else best["objective_mean"],
+        "objective_se": None if best is None else best["objective_se"],
+        "constraint": constraint,
+        "constraint_mean": None if best is None else best["constraint_mean"],
+        "constraint_se": None if best is None else best["constraint_se"],
+        "limit": limit,
+        "simulations": simulations,
+        "evaluations": summary.sort_values(["car_toll", "fare_discount"], ignore_index=True),
+        "pareto_frontier": pareto_frontier(summary),
+    }
+    return result
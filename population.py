@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from scipy.optimize import root_scalar
+from scipy.special import ndtri
+from choice import CLASSES
+from streams import POPULATION_CAR_OWNER, POPULATION_DISTANCE, POPULATION_INCOME, uniforms
+
+LOWER, MIDDLE, UPPER = CLASSES.index("lower"), CLASSES.index("middle"), CLASSES.index("upper")
+
+# Lognormal commute distance parameters (mean, sigma) per socio group
+DISTANCE_PARAMS = {
+    "lower": (2.0, 0.4),
+    "middle": (2.6, 0.5),
+    "upper": (2.3, 0.5),
+}
+DISTANCE_MEAN = np.array([DISTANCE_PARAMS[g][0] for g in CLASSES])
+DISTANCE_SIGMA = np.array([DISTANCE_PARAMS[g][1] for g in CLASSES])
+
+CHUNK_SIZE = 2**18
+POPULATION_VERSION = 2             # bump whenever generate_population changes its output
+COLUMNS = ["income", "car_owner", "group", "distance"]
+
+
+def pareto_alpha(median_income, mean_income):
+    # Pareto shape matching the requested median and mean income
+    def objective(alpha):
+        xm = mean_income * (alpha - 1) / alpha
+        return xm * 2**(1 / alpha) - median_income
+
+    result = root_scalar(objective, bracket=[1.01, 10], method='brentq')
+    return result.root
+
+
+def car_ownership_probability(income):
+    return 1 / (1 + np.exp(-(-10 + 0.0002 * income)))
+
+
+def socio_group_codes(income, median_income):
+    groups = np.full(len(income), MIDDLE, dtype=np.int8)
+    groups[income < 0.75 * median_income] = LOWER
+    groups[income > 2 * median_income] = UPPER
+    return groups
+
+
+def generate_population(num_agents, median_income, mean_income, seed, chunk_size=CHUNK_SIZE):
+    # Every column is an inverse-CDF transform of counter-based uniforms addressed by the
+    # agent's absolute index, so any chunk (or shard) of the population can be generated on
+    # its own. Chunks only bound the size of temporaries.
+    alpha = pareto_alpha(median_income, mean_income)
+    xm = mean_income * (alpha - 1) / alpha
+
+    population = {
+        "income": np.empty(num_agents),
+        "car_owner": np.empty(num_agents, dtype=bool),
+        "group": np.empty(num_agents, dtype=np.int8),
+        "distance": np.empty(num_agents),
+    }
+    for start in range(0, num_agents, chunk_size):
+        n = min(chunk_size, num_agents - start)
+        chunk = slice(start, start + n)
+
+        # Shifted by half a grid step to stay strictly inside (0, 1)
+        u = uniforms(seed, POPULATION_INCOME, 0, start, n) + 2.0**-54
+        income = xm * u ** (-1 / alpha)
+        groups = socio_group_codes(income, median_income)
+
+        population["income"][chunk] = income
+        population["car_owner"][chunk] = (
+            uniforms(seed, POPULATION_CAR_OWNER, 0, start, n) < car_ownership_probability(income)
+        )
+        population["group"][chunk] = groups
+        u = uniforms(seed, POPULATION_DISTANCE, 0, start, n) + 2.0**-54
+        population["distance"][chunk] = np.exp(DISTANCE_MEAN[groups] + DISTANCE_SIGMA[groups] * ndtri(u))
+    return alpha, population
+
+
+def population_inputs(num_agents, median_income, mean_income, seed):
+    # Everything generate_population's output depends on
+    return {
+        "version": POPULATION_VERSION,
+        "num_agents": int(num_agents),
+        "median_income": float(median_income),
+        "mean_income": float(mean_income),
+        "seed": seed,
+    }
+
+
+def population_key(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def load_population(path):
+    # Columns come back as read-only memory maps, so every process loading the same
+    # population shares one copy through the page cache
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    population = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in COLUMNS
+    }
+    return meta["alpha"], population
+
+
+def save_population(path, alpha, population, inputs):
+    # Written to a temporary directory and renamed into place, so readers never see a
+    # partial population and concurrent writers of the same key are harmless
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-population-")
+    for name in COLUMNS:
+        np.save(os.path.join(tmp, f"{name}.npy"), population[name])
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({"alpha": alpha, **inputs}, f)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            raise
+
+
+def cached_population(num_agents, median_income, mean_income, seed, root_seed, cache_dir, chunk_size=CHUNK_SIZE):
+    # seed is the model's seed argument, root_seed the stream seed derived from it.
+    # Unseeded populations are never reused, so they bypass the cache.
+    if cache_dir is None or seed is None:
+        return generate_population(num_agents, median_income, mean_income, root_seed, chunk_size)
+    inputs = population_inputs(num_agents, median_income, mean_income, seed)
+    path = os.path.join(cache_dir, population_key(inputs))
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        alpha, population = generate_population(num_agents, median_income, mean_income, root_seed, chunk_size)
+        save_population(path, alpha, population, inputs)
+    return load_population(path)
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+from sweep import SWEEP_KEYS, expand_parameters, iter_runs
+
+# Sequential replication with common random numbers. Replication r of every policy cell runs
+# with seed + r, so all cells share the population and the (step, agent) choice draws (see
+# streams.py) and differences between cells are low-variance. Each round gives the cells that
+# are not yet precise enough `batch` more replications, until the confidence interval
+# half-width of every target metric (its final-step value) is within its threshold, or
+# max_replications is reached. With a baseline policy the criterion applies to each cell's
+# paired difference from the baseline instead, which is where common random numbers pay off.
+
+
+def half_width(values, confidence=0.95):
+    n = len(values)
+    if n < 2:
+        return np.inf
+    return stats.t.ppf(0.5 + confidence / 2, n - 1) * np.std(values, ddof=1) / np.sqrt(n)
+
+
+def policy_key(kwargs):
+    return (float(kwargs.get("car_toll", 0.0)), float(kwargs.get("fare_discount", 0.0)))
+
+
+def summarize_replications(finals, thresholds, baseline=None, confidence=0.95):
+    # finals maps policy -> list of {metric: final value}, indexed by replication
+    records = []
+    for (car_toll, fare_discount), values in finals.items():
+        record = {"car_toll": car_toll, "fare_discount": fare_discount, "replications": len(values)}
+        converged = True
+        for metric, threshold in thresholds.items():
+            samples = np.array([v[metric] for v in values])
+            record[f"{metric}_mean"] = samples.mean()
+            record[f"{metric}_half_width"] = half_width(samples, confidence)
+            if baseline is None:
+                converged &= record[f"{metric}_half_width"] <= threshold
+            elif (car_toll, fare_discount) != baseline:
+                reference = np.array([v[metric] for v in finals[baseline][:len(samples)]])
+                differences = samples - reference
+                record[f"{metric}_difference"] = differences.mean()
+                record[f"{metric}_difference_half_width"] = half_width(differences, confidence)
+                converged &= record[f"{metric}_difference_half_width"] <= threshold
+        record["converged"] = bool(converged)
+        records.append(record)
+    return pd.DataFrame(records).sort_values(["car_toll", "fare_discount"], ignore_index=True)
+
+
+def run_replications(
+    parameters,
+    thresholds,
+    max_steps=24,
+    reporters=None,
+    data_collection_period=1,
+    baseline=None,
+    confidence=0.95,
+    min_replications=3,
+    max_replications=30,
+    batch=2,
+    seed=0,
+    processes=None,
+    fork_warmup=True,
+    store=None,
+):
+    # thresholds maps each target metric (e.g. "total_ghg", "total_system_profit") to the
+    # largest acceptable CI half-width; baseline is an optional (car_toll, fare_discount) cell.
+    # With store (see result_store.py), replications run before are read back, not rerun.
+    cells = {policy_key(kwargs): kwargs for kwargs in expand_parameters(parameters)}
+    if baseline is not None:
+        baseline = (float(baseline[0]), float(baseline[1]))
+        if baseline not in cells:
+            raise ValueError(f"baseline {baseline} is not one of the swept policies")
+    reporters = list(dict.fromkeys(list(reporters or []) + list(thresholds)))
+    finals = {key: [] for key in cells}
+    rows = []
+    needed = {key: min_replications for key in cells}
+    rounds = simulations = 0
+
+    while needed:
+        runs = [
+            ({**cells[key], "seed": seed + r}, r)
+            for key, count in needed.items()
+            for r in range(len(finals[key]), count)
+        ]
+        results = {key: {} for key in cells}
+        for run_rows in iter_runs(
+            runs, max_steps, reporters, data_collection_period, processes, fork_warmup=fork_warmup,
+            store=store,
+        ):
+            rows.extend(run_rows)
+            # A forked task returns the rows of several policies; keep each run's last step
+            for row in sorted(run_rows, key=lambda row: row["Step"]):
+                results[policy_key(row)][row["iteration"]] = {metric: row[metric] for metric in thresholds}
+        for key, replications in results.items():
+            finals[key].extend(replications[r] for r in sorted(replications))
+        rounds += 1
+        simulations += len(runs)
+
+        summary = summarize_replications(finals, thresholds, baseline, confidence)
+        needed = {
+            (row.car_toll, row.fare_discount): min(row.replications + batch, max_replications)
+            for row in summary.itertuples()
+            if not row.converged and row.replications < max_replications
+        }
+        if baseline is not None and needed:
+            # Differences pair replication r of a cell with replication r of the baseline
+            needed[baseline] = max(len(finals[baseline]), *needed.values())
+
+    return {
+        "summary": summary,
+        "rows": pd.DataFrame(rows).sort_values(SWEEP_KEYS, ignore_index=True),
+        "converged": bool(summary["converged"].all()),
+        "rounds": rounds,
+        "simulations": simulations,
+        "baseline": baseline,
+        "confidence": confidence,
+    }
@@ -0,0 +1,136 @@
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from model import TransportModel
+from steady_state import SteadyStateDetector
+
+# Persistent store of finished runs. An entry holds one run's reporter rows (Step plus every
+# reporter) and is keyed by a hash of the full TransportModel parameter set (defaults filled
+# in), the seed, max_steps, data_collection_period and the code version: a hash of the
+# source of every module the stored rows depend on, including how sweeps build rows and
+# when steady_state stops a run. Editing any of them starts a new version directory, so stale
+# entries are never read; prune() deletes them. Unseeded runs are not reproducible and are
+# never stored. Entries are written under a temporary name and renamed, like the population
+# cache, so concurrent workers can share a store.
+MODEL_SOURCES = [
+    "model.py",
+    "agent.py",
+    "choice.py",
+    "cohorts.py",
+    "population.py",
+    "streams.py",
+    "shards.py",
+    "scenarios.py",
+    "network.py",
+    "steady_state.py",
+    "sweep.py",
+]
+# Arguments that do not change reporter values
+RESULT_NEUTRAL = ("history_sample", "history_steps", "history_path", "population_cache", "profiler", "shards", "sink")
+# What sweep.run_model fills in before its caller's arguments
+RUN_DEFAULTS = {"engine": "vectorized", "history_sample": 0}
+
+
+def code_version(root=None):
+    root = os.path.dirname(os.path.abspath(__file__)) if root is None else root
+    digest = hashlib.sha256()
+    for name in MODEL_SOURCES:
+        digest.update(name.encode())
+        with open(os.path.join(root, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def canonical(value):
+    # JSON-safe form of a parameter or reporter value
+    if isinstance(value, dict):
+        return {str(k): canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, range, np.ndarray)):
+        return [canonical(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, SteadyStateDetector):
+        return canonical(value.options())
+    return value
+
+
+def model_parameters(kwargs):
+    # The full argument set TransportModel runs with, defaults included
+    signature = inspect.signature(TransportModel.__init__)
+    parameters = {
+        name: p.default for name, p in signature.parameters.items()
+        if p.default is not inspect.Parameter.empty
+    }
+    parameters.update(RUN_DEFAULTS)
+    parameters.update(kwargs)
+    return {name: canonical(value) for name, value in parameters.items() if name not in RESULT_NEUTRAL}
+
+
+class ResultStore:
+    def __init__(self, path, version=None):
+        self.path = path
+        self.version = code_version() if version is None else version
+
+    def inputs(self, kwargs, max_steps, data_collection_period=1):
+        return {
+            "parameters": model_parameters(kwargs),
+            "max_steps": int(max_steps),
+            "data_collection_period": int(data_collection_period),
+            "version": self.version,
+        }
+
+    def entry_path(self, kwargs, max_steps, data_collection_period=1):
+        # None for unseeded runs
+        if kwargs.get("seed") is None:
+            return None
+        inputs = self.inputs(kwargs, max_steps, data_collection_period)
+        key = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:32]
+        return os.path.join(self.path, self.version, key[:2], f"{key}.json")
+
+    def get(self, kwargs, max_steps, data_collection_period=1, reporters=()):
+        # The run's rows, or None if it is not stored or lacks one of the reporters
+        path = self.entry_path(kwargs, max_steps, data_collection_period)
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path) as f:
+            rows = json.load(f)["rows"]
+        if rows and any(name not in rows[0] for name in reporters):
+            return None
+        return rows
+
+    def put(self, kwargs, max_steps, data_collection_period, rows):
+        path = self.entry_path(kwargs, max_steps, data_collection_period)
+        if path is None:
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {
+            "inputs": self.inputs(kwargs, max_steps, data_collection_period),
+            "rows": [{name: canonical(value) for name, value in row.items()} for row in rows],
+        }
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-", suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+        return path
+
+    def __len__(self):
+        root = os.path.join(self.path, self.version)
+        if not os.path.isdir(root):
+            return 0
+        return sum(
+            name.endswith(".json") and not name.startswith(".")
+            for _, _, names in os.walk(root) for name in names
+        )
+
+    def prune(self):
+        # Deletes entries from other code versions; returns the versions removed
+        if not os.path.isdir(self.path):
+            return []
+        stale = [name for name in os.listdir(self.path) if name != self.version]
+        for name in stale:
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        return stale
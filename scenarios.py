@@ -0,0 +1,137 @@
+import copy
+import numpy as np
+from choice import CAR, MODES, class_mode_counts, sample_choices, utility_matrix, utility_terms
+from model import TransportModel
+from population import CHUNK_SIZE
+from streams import MODE_CHOICE, uniforms
+
+# K policy scenarios advanced together on a (scenario, agent) grid. The population, the
+# per-agent utility terms that do not depend on policy or congestion, and the choice draws
+# (common random numbers, see streams.py) are shared; each scenario has its own habit streaks,
+# modes, congestion and accounts. Scenarios are identical until the policy switch, so they
+# share a single row until then. Each scenario reproduces a separate vectorized
+# TransportModel run with the same seed and policy exactly.
+
+
+class ScenarioState:
+    # One scenario's scalar state and mode counts; TransportModel's accounting methods
+    # run on it unchanged
+    def __init__(self, model):
+        vars(self).update({
+            name: value for name, value in vars(model).items()
+            if not name.startswith("_") and isinstance(value, (bool, int, float, str, np.number))
+        })
+        self.mode_counts = {mode: dict(counts) for mode, counts in model.mode_counts.items()}
+        self.total_mode_counts = dict(model.total_mode_counts)
+
+
+class ScenarioModel:
+    def __init__(self, policies, **kwargs):
+        # policies is a list of (car_toll, fare_discount), the same arguments TransportModel takes
+        self.model = model = TransportModel(**{**kwargs, "engine": "vectorized", "history_sample": 0})
+        if model.network is not None:
+            raise ValueError("ScenarioModel uses the global congestion level; run network models one by one")
+        if model.steady_state is not None:
+            raise ValueError("ScenarioModel steps every policy to max_steps; use steady_state with single runs")
+        self.policies = [(car_toll, fare_discount) for car_toll, fare_discount in policies]
+        self.steps = 0
+
+        # Shared per-agent utility terms, computed once for every step and scenario
+        self.terms = utility_terms(model, model.incomes, model.distances)
+
+        # One shared scenario row until the policy switch
+        self.car_habit_streaks = np.zeros((1, model.num_agents), dtype=np.int32)
+        self.mode_codes = np.full((1, model.num_agents), -1, dtype=np.int8)
+        self.states = [ScenarioState(model)]
+
+    @property
+    def shared(self):
+        return len(self.states) == 1 and len(self.policies) > 1
+
+    def utilities(self, start, stop, streaks):
+        # (scenario, agent, mode) utilities for agents start..stop-1: utility_matrix with
+        # one (scenario, 1) row of congestion and policy per scenario
+        model = self.model
+        chunk = slice(start, stop)
+        return utility_matrix(
+            model,
+            model.incomes[chunk],
+            model.distances[chunk],
+            model.car_ownerships[chunk],
+            model.group_codes[chunk],
+            streaks,
+            congestion_level=np.array([[s.congestion_level] for s in self.states]),
+            car_toll=np.array([[s.car_toll] for s in self.states]),
+            fare_discount=np.array([[s.fare_discount] for s in self.states]),
+            terms={name: values[chunk] for name, values in self.terms.items()},
+        )
+
+    def step(self):
+        model = self.model
+        self.steps += 1
+        scenarios = len(self.states)
+        chunk_size = max(1, CHUNK_SIZE // scenarios)
+        for start in range(0, model.num_agents, chunk_size):
+            stop = min(start + chunk_size, model.num_agents)
+            streaks = self.car_habit_streaks[:, start:stop]
+            utilities = self.utilities(start, stop, streaks)
+            draws = uniforms(model.stream_seed, MODE_CHOICE, self.steps, start, stop - start)
+            probs = model.mode_probabilities(utilities.reshape(-1, len(MODES)))
+            modes = sample_choices(probs, np.tile(draws, scenarios)).reshape(scenarios, -1)
+            self.mode_codes[:, start:stop] = modes
+            self.car_habit_streaks[:, start:stop] = np.where(modes == CAR, streaks + 1, 0)
+
+        # Per-scenario accounting, in the same order as TransportModel.step
+        for k, state in enumerate(self.states):
+            state.steps = self.steps
+            TransportModel.set_mode_counts(state, class_mode_counts(model.group_codes, self.mode_codes[k]))
+            TransportModel.update_congestion(state)
+            state.total_bike_walk_count = sum(state.mode_counts["bike_walk"].values())
+            TransportModel.mode_share_pcts(state)
+            TransportModel.congestion_costs(state)
+            TransportModel.ghg_emissions(state)
+            TransportModel.transit_costs(state)
+            TransportModel.car_road_costs(state)
+            state.total_system_profit = state.toll_profit + state.total_transit_profit - state.total_cong_cost
+
+        if self.steps == model.policy_step:
+            if self.shared:
+                self.split()
+            for state, (car_toll, fare_discount) in zip(self.states, self.policies):
+                state.new_car_toll = car_toll
+                state.new_fare_discount = fare_discount
+                state.car_toll += car_toll
+                state.fare_discount = fare_discount
+
+    def split(self):
+        # Gives every policy its own copy of the (so far identical) shared scenario
+        scenarios = len(self.policies)
+        self.states = [copy.deepcopy(self.states[0]) for _ in range(scenarios)]
+        self.car_habit_streaks = np.repeat(self.car_habit_streaks, scenarios, axis=0)
+        self.mode_codes = np.repeat(self.mode_codes, scenarios, axis=0)
+
+    def scenario_states(self):
+        # (policy, state) pairs; while shared, every policy reports the shared state
+        if len(self.states) == len(self.policies):
+            return list(zip(self.policies, self.states))
+        return [(policy, self.states[0]) for policy in self.policies]
+
+    def reporter_rows(self, iteration, reporters):
+        rows = []
+        for (car_toll, fare_discount), state in self.scenario_states():
+            row = {"fare_discount": fare_discount, "car_toll": car_toll, "iteration": iteration, "Step": self.steps}
+            for name in reporters:
+                row[name] = getattr(state, name)
+            rows.append(row)
+        return rows
+
+
+def run_scenario_model(kwargs, policies, iteration, max_steps, reporters, data_collection_period=1):
+    # Same rows as run_forked, from one ScenarioModel instead of one model per policy
+    model = ScenarioModel(policies, **kwargs)
+    rows = []
+    while model.steps < max_steps:
+        model.step()
+        if model.steps % data_collection_period == 0 or model.steps == max_steps:
+            rows.extend(model.reporter_rows(iteration, reporters))
+    return rows
@@ -0,0 +1,249 @@
+import argparse
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+from sweep import iter_runs
+
+# Global sensitivity analysis over TransportModel constructor parameters. Sobol indices use
+# the Saltelli design: two quasi-random base matrices A and B (N rows each) plus, for every
+# parameter i, A with column i taken from B, i.e. N * (d + 2) model runs. First-order indices
+# use the Saltelli (2010) estimator and total indices the Jansen estimator; intervals come
+# from bootstrapping the N base rows. Morris elementary effects are the cheap screening
+# alternative, r * (d + 1) runs. Every design point runs with the same seed (common random
+# numbers), so the indices measure parameter effects rather than simulation noise. Runs are
+# evaluated batch_size at a time and only their final reporter values are kept.
+
+# Ranges for the economic parameters that reach the outputs. road_capacity is recomputed
+# from the initial congestion and commute_distance_* are stored but unused, so they are left
+# out. The income ranges keep mean / median high enough that the Pareto scale stays below the
+# lower-class threshold (0.75 * median); otherwise the lower class is empty.
+SENSITIVITY_BOUNDS = {
+    "car_cost": (6.0, 14.0),
+    "bus_cost": (2.0, 6.0),
+    "train_cost": (3.0, 9.0),
+    "median_income": (55000.0, 62000.0),
+    "mean_income": (88000.0, 100000.0),
+    "avg_freeflow_duration": (0.5, 1.5),
+    "gas_cost": (0.0, 6.0),
+    "diesel_cost": (0.0, 6.0),
+    "rush_hours": (2.0, 4.0),
+    "car_hourly_value": (15.0, 30.0),
+    "truck_hourly_value": (45.0, 85.0),
+    "truck_ratio": (0.05, 0.12),
+    "train_cost_base": (15.0, 30.0),
+    "bus_cost_base": (6.0, 14.0),
+    "train_baseline_ridership": (0.08, 0.17),
+    "bus_baseline_ridership": (0.07, 0.15),
+    "car_enforcement_pct": (0.05, 0.2),
+    "road_maintainence_cost_car": (0.5, 1.5),
+    "road_maintainence_cost_truck": (5.0, 15.0),
+}
+SENSITIVITY_OUTPUTS = ["total_ghg_sum", "total_system_profit"]
+
+
+def scale(unit, bounds):
+    # Maps points in the unit cube to the parameter ranges, one column per bounds entry
+    low, high = np.array(list(bounds.values())).T
+    return low + unit * (high - low)
+
+
+def sobol_design(bounds, base_samples, seed=0):
+    # (A, B, AB) in parameter units; AB has shape (d, N, d). base_samples is rounded up to a
+    # power of two, which keeps the Sobol sequence balanced.
+    d = len(bounds)
+    m = int(np.ceil(np.log2(max(base_samples, 2))))
+    unit = qmc.Sobol(2 * d, scramble=True, seed=seed).random_base2(m)
+    A, B = scale(unit[:, :d], bounds), scale(unit[:, d:], bounds)
+    AB = np.repeat(A[None], d, axis=0)
+    for i in range(d):
+        AB[i, :, i] = B[:, i]
+    return A, B, AB
+
+
+def morris_design(bounds, trajectories, levels=4, seed=0):
+    # (r, d + 1, d) unit-cube trajectories, each changing one parameter per move by delta
+    d = len(bounds)
+    rng = np.random.default_rng(seed)
+    delta = levels / (2 * (levels - 1))
+    grid = np.arange(levels // 2) / (levels - 1)             # starts that stay inside after +delta
+    points = np.empty((trajectories, d + 1, d))
+    orders = np.empty((trajectories, d), dtype=int)
+    for t in range(trajectories):
+        x = rng.choice(grid, size=d)
+        orders[t] = rng.permutation(d)
+        points[t, 0] = x
+        for move, i in enumerate(orders[t], start=1):
+            x = x.copy()
+            x[i] += delta
+            points[t, move] = x
+    return points, orders, delta
+
+
+def evaluate(design, names, outputs, max_steps=24, fixed=None, seed=0, processes=None, batch_size=256,
+             max_tasks_per_child=None):
+    # Final-step outputs for every design row, shape (rows, len(outputs)). Only one batch of
+    # runs is queued at a time; workers are reused across tasks unless max_tasks_per_child.
+    fixed = dict(fixed or {})
+    results = np.full((len(design), len(outputs)), np.nan)
+    for batch_start in range(0, len(design), batch_size):
+        runs = [
+            ({**fixed, **dict(zip(names, map(float, design[i]))), "seed": seed}, i)
+            for i in range(batch_start, min(batch_start + batch_size, len(design)))
+        ]
+        for run_rows in iter_runs(
+            runs, max_steps, outputs, data_collection_period=max_steps, processes=processes,
+            max_tasks_per_child=max_tasks_per_child,
+        ):
+            for row in run_rows:
+                results[row["iteration"]] = [row[name] for name in outputs]
+    return results
+
+
+def sobol_indices(f_A, f_B, f_AB):
+    # First-order and total indices for one output; f_AB has shape (d, N)
+    variance = np.var(np.concatenate([f_A, f_B]), ddof=1)
+    first = np.mean(f_B * (f_AB - f_A), axis=1) / variance
+    total = 0.5 * np.mean((f_A - f_AB) ** 2, axis=1) / variance
+    return first, total
+
+
+def bootstrap_sobol(f_A, f_B, f_AB, resamples=1000, confidence=0.95, seed=0):
+    # Percentile intervals from resampling the N base rows, shape (2, d) each
+    rng = np.random.default_rng(seed)
+    n = len(f_A)
+    first, total = np.empty((resamples, len(f_AB))), np.empty((resamples, len(f_AB)))
+    for b in range(resamples):
+        rows = rng.integers(0, n, n)
+        first[b], total[b] = sobol_indices(f_A[rows], f_B[rows], f_AB[:, rows])
+    q = [(1 - confidence) / 2, (1 + confidence) / 2]
+    return np.quantile(first, q, axis=0), np.quantile(total, q, axis=0)
+
+
+def run_sobol(
+    bounds=None,
+    base_samples=256,
+    outputs=None,
+    max_steps=24,
+    fixed=None,
+    seed=0,
+    processes=None,
+    batch_size=256,
+    resamples=1000,
+    confidence=0.95,
+):
+    # Sobol indices of every output with respect to every parameter in bounds (default
+    # SENSITIVITY_BOUNDS); fixed holds the other TransportModel arguments, e.g. num_agents
+    bounds = dict(SENSITIVITY_BOUNDS if bounds is None else bounds)
+    outputs = list(SENSITIVITY_OUTPUTS if outputs is None else outputs)
+    names = list(bounds)
+    d = len(names)
+    A, B, AB = sobol_design(bounds, base_samples, seed)
+    n = len(A)
+    design = np.concatenate([A, B, AB.reshape(d * n, d)])
+    values = evaluate(design, names, outputs, max_steps, fixed, seed, processes, batch_size)
+
+    records = []
+    for k, output in enumerate(outputs):
+        f_A, f_B, f_AB = values[:n, k], values[n:2 * n, k], values[2 * n:, k].reshape(d, n)
+        first, total = sobol_indices(f_A, f_B, f_AB)
+        first_ci, total_ci = bootstrap_sobol(f_A, f_B, f_AB, resamples, confidence, seed)
+        for i, name in enumerate(names):
+            records.append({
+                "output": output,
+                "parameter": name,
+                "first_order": first[i],
+                "first_order_low": first_ci[0, i],
+                "first_order_high": first_ci[1, i],
+                "total": total[i],
+                "total_low": total_ci[0, i],
+                "total_high": total_ci[1, i],
+            })
+    samples = pd.DataFrame(design, columns=names)
+    samples[outputs] = values
+    return {
+        "indices": pd.DataFrame(records),
+        "samples": samples,
+        "base_samples": n,
+        "evaluations": len(design),
+        "confidence": confidence,
+    }
+
+
+def run_morris(
+    bounds=None,
+    trajectories=20,
+    levels=4,
+    outputs=None,
+    max_steps=24,
+    fixed=None,
+    seed=0,
+    processes=None,
+    batch_size=256,
+):
+    # Elementary effects: mu_star (mean absolute effect) ranks parameters, sigma flags
+    # nonlinearity or interactions. Effects are per unit of the scaled (0..1) range.
+    bounds = dict(SENSITIVITY_BOUNDS if bounds is None else bounds)
+    outputs = list(SENSITIVITY_OUTPUTS if outputs is None else outputs)
+    names = list(bounds)
+    d = len(names)
+    points, orders, delta = morris_design(bounds, trajectories, levels, seed)
+    design = scale(points.reshape(-1, d), bounds)
+    values = evaluate(design, names, outputs, max_steps, fixed, seed, processes, batch_size)
+    values = values.reshape(trajectories, d + 1, len(outputs))
+
+    effects = np.empty((trajectories, d, len(outputs)))
+    for t in range(trajectories):
+        effects[t, orders[t]] = np.diff(values[t], axis=0) / delta
+    records = []
+    for k, output in enumerate(outputs):
+        for i, name in enumerate(names):
+            records.append({
+                "output": output,
+                "parameter": name,
+                "mu": effects[:, i, k].mean(),
+                "mu_star": np.abs(effects[:, i, k]).mean(),
+                "sigma": effects[:, i, k].std(ddof=1),
+            })
+    samples = pd.DataFrame(design, columns=names)
+    samples[outputs] = values.reshape(-1, len(outputs))
+    return {
+        "effects": pd.DataFrame(records),
+        "samples": samples,
+        "trajectories": trajectories,
+        "evaluations": len(design),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Global sensitivity of model outputs to its parameters")
+    parser.add_argument("--method", choices=["sobol", "morris"], default="sobol")
+    parser.add_argument("--base-samples", type=int, default=256, help="Sobol base rows (rounded up to a power of two)")
+    parser.add_argument("--trajectories", type=int, default=20, help="Morris trajectories")
+    parser.add_argument("--num-agents", type=int, default=20000)
+    parser.add_argument("--max-steps", type=int, default=24)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the indices (or effects) as CSV to this file")
+    parser.add_argument("--samples", help="write every evaluated design point as CSV to this file")
+    args = parser.parse_args()
+
+    fixed = {"num_agents": args.num_agents}
+    if args.method == "sobol":
+        result = run_sobol(
+            base_samples=args.base_samples, max_steps=args.max_steps, fixed=fixed, seed=args.seed,
+            processes=args.processes, batch_size=args.batch_size,
+        )
+        table = result["indices"].sort_values(["output", "total"], ascending=[True, False])
+    else:
+        result = run_morris(
+            trajectories=args.trajectories, max_steps=args.max_steps, fixed=fixed, seed=args.seed,
+            processes=args.processes, batch_size=args.batch_size,
+        )
+        table = result["effects"].sort_values(["output", "mu_star"], ascending=[True, False])
+    print(f"{result['evaluations']} evaluations")
+    print(table.to_string(index=False))
+    if args.output:
+        table.to_csv(args.output, index=False)
+    if args.samples:
+        result["samples"].to_csv(args.samples, index=False)
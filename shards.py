@@ -0,0 +1,150 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from choice import class_mode_counts
+
+# Sharded stepping for the array engine. The per-agent arrays live in shared memory and each
+# worker process owns a contiguous slice of agents. Every step the parent sends the state all
+# agents read (congestion level, policy, constants), workers choose modes for their slice and
+# reply with (class, mode) counts, and the parent reduces the counts and runs the rest of the
+# step. Draws are addressed by (step, agent index), so results match the vectorized engine.
+SHARED_ARRAYS = {
+    "incomes": np.float64,
+    "distances": np.float64,
+    "car_ownerships": np.bool_,
+    "group_codes": np.int8,
+    "car_habit_streaks": np.int32,
+    "mode_codes": np.int8,
+}
+# Model attributes step_slice / utility_matrix / mode_probabilities read, sent every step
+STEP_ATTRIBUTES = [
+    "steps",
+    "stream_seed",
+    "chunk_size",
+    "congestion_level",
+    "base_congestion_level",
+    "car_toll",
+    "base_car_toll",
+    "fare_discount",
+    "car_cost",
+    "bus_cost",
+    "train_cost",
+    "median_income",
+    "utility_constant_table",
+    "choice_model",
+    "lambda_private",
+    "lambda_public",
+]
+
+
+def shard_bounds(num_agents, shards):
+    edges = np.linspace(0, num_agents, shards + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+
+def attach_arrays(names, num_agents):
+    blocks, arrays = [], {}
+    for name, dtype in SHARED_ARRAYS.items():
+        block = shared_memory.SharedMemory(name=names[name])
+        blocks.append(block)
+        arrays[name] = np.ndarray(num_agents, dtype=dtype, buffer=block.buf)
+    return blocks, arrays
+
+
+class ShardView:
+    # Stands in for the model inside a worker: the shared arrays plus the per-step attributes
+    def __init__(self, arrays):
+        from model import TransportModel
+
+        vars(self).update(arrays)
+        self.network = None                 # network mode runs on the vectorized engine only
+        self._step_slice = TransportModel.step_slice
+        self._mode_probabilities = TransportModel.mode_probabilities
+
+    def step_slice(self, start, stop):
+        self._step_slice(self, start, stop)
+
+    def mode_probabilities(self, utilities):
+        return self._mode_probabilities(self, utilities)
+
+
+def shard_worker(connection, names, num_agents, start, stop):
+    blocks, arrays = attach_arrays(names, num_agents)
+    view = ShardView(arrays)
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            try:
+                vars(view).update(message)
+                for chunk_start in range(start, stop, view.chunk_size):
+                    view.step_slice(chunk_start, min(chunk_start + view.chunk_size, stop))
+                connection.send(class_mode_counts(view.group_codes[start:stop], view.mode_codes[start:stop]))
+            except Exception as e:
+                connection.send(e)
+    finally:
+        del view, arrays
+        for block in blocks:
+            block.close()
+
+
+class ShardPool:
+    # Owns the shared memory and the worker processes for one model
+    def __init__(self, num_agents, shards):
+        self.num_agents = num_agents
+        self.blocks = {}
+        self.arrays = {}
+        for name, dtype in SHARED_ARRAYS.items():
+            block = shared_memory.SharedMemory(create=True, size=max(1, num_agents * np.dtype(dtype).itemsize))
+            self.blocks[name] = block
+            self.arrays[name] = np.ndarray(num_agents, dtype=dtype, buffer=block.buf)
+        self.bounds = shard_bounds(num_agents, shards)
+        self.connections = []
+        self.processes = []
+
+    def start(self):
+        names = {name: block.name for name, block in self.blocks.items()}
+        for start, stop in self.bounds:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=shard_worker, args=(child, names, self.num_agents, start, stop), daemon=True
+            )
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def step(self, model):
+        # Returns the (class, mode) counts summed over all shards
+        if not self.processes:
+            self.start()
+        message = {name: getattr(model, name) for name in STEP_ATTRIBUTES}
+        for connection in self.connections:
+            connection.send(message)
+        # Every reply is read before raising, so the pipes stay in step
+        replies = [connection.recv() for connection in self.connections]
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        return sum(replies)
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.connections, self.processes = [], []
+        self.arrays = {}
+        for block in self.blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                pass        # arrays still referenced elsewhere; the mapping goes with them
+            block.unlink()
+        self.blocks = {}
@@ -0,0 +1,112 @@
+import os
+import uuid
+import numpy as np
+from choice import CLASSES, MODES
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:        # optional: only needed when writing or reading Parquet output
+    pa = ds = pq = None
+
+# Streaming Parquet output for reporter rows. Rows are buffered and written every flush_every
+# rows as a new part file in a dataset directory, so a long run or a large sweep holds at most
+# one buffer in memory, an interrupted run keeps everything up to its last flush, and readers
+# can load the directory lazily with column and row filters. Part files are written under a
+# temporary name and renamed, so readers never see a partial file.
+INTEGER_COLUMNS = ("seed", "iteration", "Step", "stopped_step")
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("Parquet output needs pyarrow (pip install pyarrow)")
+
+
+def is_integer_column(name):
+    return name in INTEGER_COLUMNS or "_count_" in name
+
+
+def write_rows(path, rows, prefix=None):
+    # Writes rows (a list of dicts) as one part file in the dataset directory path. Values are
+    # cast per column (counters to int, everything else to float), so a toll given as 5 in one
+    # run and 2.5 in another still lands in one schema.
+    require_pyarrow()
+    if not rows:
+        return None
+    os.makedirs(path, exist_ok=True)
+    name = f"part-{prefix or uuid.uuid4().hex}.parquet"
+    tmp = os.path.join(path, f".{name}.tmp")
+    columns = {
+        column: [int(row[column]) if is_integer_column(column) else float(row[column]) for row in rows]
+        for column in rows[0]
+    }
+    pq.write_table(pa.Table.from_pydict(columns), tmp)
+    os.replace(tmp, os.path.join(path, name))
+    return name
+
+
+def agent_aggregates(model):
+    # Per-group mode counts and the mean car habit streak, for any engine
+    row = {
+        f"{mode}_count_{group}": model.mode_counts[mode][group] for mode in MODES for group in CLASSES
+    }
+    if model.engine in ("vectorized", "sharded"):
+        streak = float(model.car_habit_streaks.mean())
+    elif model.engine == "cohort":
+        buckets = np.arange(model.cohort_counts.shape[1])
+        streak = float((model.cohort_counts * buckets).sum() / model.cohort_counts.sum())
+    else:
+        streak = float(np.mean([a.car_habit_streak for a in model.agent_list]))
+    row["mean_car_habit_streak"] = streak
+    return row
+
+
+class ReporterSink:
+    # Records one row per model step: seed, policy, Step, every DataCollector model reporter
+    # and, with agent_aggregates, the per-group mode counts and mean habit streak.
+
+    def __init__(self, path, flush_every=50, agent_aggregates=False):
+        require_pyarrow()
+        self.path = path
+        self.flush_every = flush_every
+        self.agent_aggregates = agent_aggregates
+        self.rows = []
+        self.prefix = uuid.uuid4().hex
+        self.parts = 0
+
+    def record(self, model):
+        row = {
+            "seed": model.stream_seed,
+            "car_toll": model.new_car_toll,
+            "fare_discount": model.new_fare_discount,
+            "Step": model.steps,
+        }
+        for name in model.datacollector.model_reporters:
+            row[name] = getattr(model, name)
+        if self.agent_aggregates:
+            row.update(agent_aggregates(model))
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            write_rows(self.path, self.rows, prefix=f"{self.prefix}-{self.parts:05d}")
+            self.parts += 1
+            self.rows = []
+
+    def close(self):
+        self.flush()
+
+
+def reporter_dataset(path):
+    # Lazy pyarrow dataset over every part file in path
+    require_pyarrow()
+    return ds.dataset(path, format="parquet")
+
+
+def load_reporters(path, columns=None, filter=None):
+    # DataFrame of the selected columns and rows (filter is a pyarrow.dataset expression,
+    # e.g. ds.field("car_toll") == 5), read without loading the rest
+    return reporter_dataset(path).to_table(columns=columns, filter=filter).to_pandas()
@@ -0,0 +1,40 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Measures how long a fresh interpreter takes to import app.py (after solara, which the
+# server has already loaded), so dashboard cold start can be tracked over time.
+MEASURE = (
+    "import time, solara; t = time.perf_counter(); import app; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def measure_startup(repeats=5):
+    samples = []
+    for _ in range(repeats):
+        out = subprocess.run(
+            [sys.executable, "-c", MEASURE], capture_output=True, text=True, check=True
+        )
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return {
+        "repeats": repeats,
+        "median_seconds": statistics.median(samples),
+        "max_seconds": max(samples),
+        "samples": samples,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure app.py import (startup) time")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="write the measurement as JSON to this file")
+    args = parser.parse_args()
+
+    result = measure_startup(args.repeats)
+    print(f"app.py import: median {result['median_seconds']:.3f}s, max {result['max_seconds']:.3f}s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,113 @@
+import numpy as np
+from scipy import stats
+
+# Online steady-state detection. After the policy switch the detector keeps the last `window`
+# values of each watched reporter and fits a line through them. A reporter is steady when,
+# at the given confidence, its drift from now to the horizon (the slope bound times the steps
+# still to run) is smaller than `tolerance` times its level: an equivalence test on the slope,
+# which also behaves when large runs have almost no noise. Without a horizon the drift across
+# the window itself is tested. Habit streaks keep pushing car share up long after the switch,
+# so the slope is rarely zero; scaling by the remaining steps is what bounds the error of the
+# extrapolated horizon row. Once every watched reporter is steady the model stops
+# (model.running = False) and records stopped_step. Cumulative reporters are then extended to
+# the horizon along the line fitted through their per-step increments over the window.
+STEADY_REPORTERS = ("car_share_pct", "congestion_level")
+CUMULATIVE_REPORTERS = ("total_ghg_sum",)
+
+
+def window_drift(values, confidence=0.95):
+    # Upper confidence bound on |slope| * (len(values) - 1), the drift across the window
+    n = len(values)
+    x = np.arange(n) - (n - 1) / 2
+    sxx = x @ x
+    slope = x @ values / sxx
+    residuals = values - values.mean() - slope * x
+    se = np.sqrt(residuals @ residuals / (n - 2) / sxx)
+    return (abs(slope) + stats.t.ppf(confidence, n - 2) * se) * (n - 1)
+
+
+class SteadyStateDetector:
+    def __init__(
+        self,
+        reporters=STEADY_REPORTERS,
+        cumulative=CUMULATIVE_REPORTERS,
+        window=6,
+        tolerance=0.01,
+        confidence=0.95,
+        horizon=None,
+    ):
+        if window < 3:
+            raise ValueError("window must be at least 3 steps")
+        self.reporters = list(reporters)
+        self.cumulative = list(cumulative)
+        self.window = window
+        self.tolerance = tolerance
+        self.confidence = confidence
+        self.horizon = horizon                  # last step the run would reach; sweeps fill in max_steps
+        self.history = {name: [] for name in dict.fromkeys(self.reporters + self.cumulative)}
+
+    def options(self):
+        # The constructor arguments; models build a fresh detector from these, so one
+        # detector passed to several runs never carries a window from one run to the next
+        return {
+            "reporters": list(self.reporters),
+            "cumulative": list(self.cumulative),
+            "window": self.window,
+            "tolerance": self.tolerance,
+            "confidence": self.confidence,
+            "horizon": self.horizon,
+        }
+
+    def update(self, model):
+        # Records this step's values; True once the post-policy dynamics are steady. Only
+        # steps after policy_step count: the new policy first affects choices then.
+        if model.steps <= model.policy_step:
+            return False
+        for name, values in self.history.items():
+            values.append(float(getattr(model, name)))
+            del values[:-(self.window + 1)]
+        return self.steady(model.steps)
+
+    def steady(self, step):
+        remaining = self.window - 1 if self.horizon is None else max(self.horizon - step, 0)
+        for name in self.reporters:
+            values = np.array(self.history[name][-self.window:])
+            if len(values) < self.window:
+                return False
+            level = max(abs(values.mean()), 1e-12)
+            drift = window_drift(values, self.confidence) * remaining / (self.window - 1)
+            if drift > self.tolerance * level:
+                return False
+        return True
+
+    def extrapolate(self, model, name, horizon):
+        # The reporter's value at step `horizon`: cumulative reporters add the increments of
+        # the line fitted through their recent increments, steady ones keep their current value
+        value = getattr(model, name)
+        values = self.history.get(name, [])
+        if name in self.cumulative and len(values) > 2:
+            increments = np.diff(values)
+            x = np.arange(len(increments)) - (len(increments) - 1) / 2
+            slope = x @ increments / (x @ x)
+            ahead = np.arange(1, horizon - model.steps + 1) + (len(increments) - 1) / 2
+            value = value + (increments.mean() + slope * ahead).sum()
+        elif name in self.cumulative and len(values) > 1:
+            value = value + (horizon - model.steps) * np.diff(values).mean()
+        return value
+
+    def snapshot(self):
+        return {name: list(values) for name, values in self.history.items()}
+
+    def restore(self, state):
+        self.history = {name: list(values) for name, values in state.items()}
+
+
+def stopping_summary(frame, max_steps):
+    # One row per run of a sweep frame (see sweep.run_sweep with steady_state): where it
+    # stopped and how many steps it saved
+    keys = ["fare_discount", "car_toll", "iteration"]
+    summary = frame.groupby(keys, as_index=False)["stopped_step"].first()
+    summary["stopped_step"] = summary["stopped_step"].where(summary["stopped_step"] > 0, max_steps)
+    summary["saved_steps"] = max_steps - summary["stopped_step"]
+    summary["saved_fraction"] = summary["saved_steps"] / max_steps
+    return summary
@@ -0,0 +1,45 @@
+import hashlib
+import numpy as np
+
+# Counter-based random streams (Philox). A draw is addressed by (seed, stream, step, index):
+# the Philox key comes from the root seed and the stream, and the counter holds the step and
+# the absolute index. Any slice of agents can therefore be drawn on its own and gets exactly
+# the values a full draw would, which keeps serial, vectorized and sharded runs identical.
+POPULATION_INCOME = 0
+POPULATION_CAR_OWNER = 1
+POPULATION_DISTANCE = 2
+MODE_CHOICE = 3
+COHORT_CHOICE = 4
+POPULATION_ORIGIN = 5
+POPULATION_DESTINATION = 6
+
+DRAWS_PER_BLOCK = 4                # Philox4x64 emits four 64-bit words per counter value
+
+
+def stream_seed(seed):
+    # Non-negative integer root seed (int64-sized unless given larger); unseeded models get
+    # one from OS entropy
+    if seed is None:
+        return int(np.random.SeedSequence().entropy) % 2**63
+    if isinstance(seed, (int, np.integer)) and seed >= 0:
+        return int(seed)
+    return int(hashlib.sha256(repr(seed).encode()).hexdigest()[:15], 16)
+
+
+def stream_key(seed, stream):
+    return np.random.SeedSequence([seed, stream]).generate_state(2, np.uint64)
+
+
+def stream_generator(seed, stream, step=0, start=0):
+    # Generator positioned at draw `start` of the (seed, stream, step) sequence
+    generator = np.random.Generator(np.random.Philox(
+        key=stream_key(seed, stream), counter=[start // DRAWS_PER_BLOCK, step, 0, 0]
+    ))
+    if start % DRAWS_PER_BLOCK:
+        generator.random(start % DRAWS_PER_BLOCK)
+    return generator
+
+
+def uniforms(seed, stream, step, start, count):
+    # Uniform [0, 1) draws for absolute indices start .. start + count - 1
+    return stream_generator(seed, stream, step, start).random(count)
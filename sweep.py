@@ -0,0 +1,315 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from model import MODEL_REPORTERS, TransportModel
+from result_store import ResultStore
+from sinks import reporter_dataset, write_rows
+
+# Parallel policy sweeps over TransportModel. Each (parameter cell, iteration) runs in a
+# worker process and sends back only the requested reporter rows.
+SWEEP_KEYS = ["fare_discount", "car_toll", "iteration", "Step"]
+
+
+def expand_parameters(parameters):
+    # Cartesian product of list-like values (strings and scalars are fixed), like mesa.batch_run
+    names, choices = [], []
+    for name, values in parameters.items():
+        if isinstance(values, (str, dict)) or not hasattr(values, "__iter__"):
+            values = [values]
+        values = list(values)
+        if not values:
+            raise ValueError(f"parameter {name!r} has no values")
+        names.append(name)
+        choices.append(values)
+    return [dict(zip(names, combo)) for combo in itertools.product(*choices)]
+
+
+def sweep_runs(parameters, iterations=1, seed=None):
+    # (kwargs, iteration) pairs; with a seed, iteration i uses seed + i in every cell
+    runs = []
+    for iteration in range(iterations):
+        for kwargs in expand_parameters(parameters):
+            kwargs = dict(kwargs)
+            if seed is not None and "seed" not in kwargs:
+                kwargs["seed"] = seed + iteration
+            runs.append((kwargs, iteration))
+    return runs
+
+
+def reporter_row(model, iteration, reporters):
+    row = {
+        "fare_discount": model.new_fare_discount,
+        "car_toll": model.new_car_toll,
+        "iteration": iteration,
+        "Step": model.steps,
+    }
+    for name in reporters:
+        row[name] = getattr(model, name)
+    return row
+
+
+def watch_horizon(model, max_steps):
+    # A steady-state detector without a horizon of its own tests drift up to max_steps
+    if model.steady_state is not None and model.steady_state.horizon is None:
+        model.steady_state.horizon = max_steps
+
+
+def finish_run(model, rows, iteration, reporters, max_steps):
+    # With a steady-state detector every row records where the run stopped, and a run that
+    # stopped early gets an extrapolated row at max_steps (see steady_state.py)
+    detector = model.steady_state
+    if detector is None:
+        return rows
+    for row in rows:
+        row["stopped_step"] = model.stopped_step
+    if 0 < model.stopped_step < max_steps:
+        row = reporter_row(model, iteration, reporters)
+        row["Step"] = max_steps
+        for name in reporters:
+            row[name] = detector.extrapolate(model, name, max_steps)
+        row["stopped_step"] = model.stopped_step
+        rows.append(row)
+    return rows
+
+
+def finish_rows(rows, output):
+    # With an output dataset directory the rows go to a Parquet part file instead of back
+    # to the parent, which then holds nothing per run
+    if output is None:
+        return rows
+    write_rows(output, rows)
+    return []
+
+
+def run_model(kwargs, iteration, max_steps, reporters, data_collection_period=1, output=None):
+    # Runs one model to max_steps and returns reporter rows every data_collection_period steps
+    # (and at the last step). Agent-level history is off unless asked for.
+    kwargs = {"engine": "vectorized", "history_sample": 0, **kwargs}
+    model = TransportModel(**kwargs)
+    watch_horizon(model, max_steps)
+    rows = []
+    while model.running and model.steps < max_steps:
+        model.step()
+        if model.steps % data_collection_period == 0 or model.steps == max_steps or not model.running:
+            rows.append(reporter_row(model, iteration, reporters))
+    rows = finish_run(model, rows, iteration, reporters, max_steps)
+    model.close()
+    return finish_rows(rows, output)
+
+
+def run_forked(kwargs, policies, iteration, max_steps, reporters, data_collection_period=1, output=None):
+    # Runs the pre-policy warm-up once, snapshots it, and branches every (car_toll, fare_discount)
+    # policy from the snapshot. Warm-up rows are shared by all branches.
+    kwargs = {"engine": "vectorized", "history_sample": 0, **kwargs}
+    model = TransportModel(**kwargs)
+    watch_horizon(model, max_steps)
+    warmup = []
+    while model.running and model.steps < min(model.policy_step, max_steps):
+        model.step()
+        if model.steps % data_collection_period == 0 or model.steps == max_steps or not model.running:
+            warmup.append(reporter_row(model, iteration, reporters))
+    checkpoint = model.snapshot()
+
+    rows = []
+    for car_toll, fare_discount in policies:
+        model.restore(checkpoint)
+        model.set_policy(car_toll, fare_discount)
+        branch = [{**row, "car_toll": car_toll, "fare_discount": fare_discount} for row in warmup]
+        while model.running and model.steps < max_steps:
+            model.step()
+            if model.steps % data_collection_period == 0 or model.steps == max_steps or not model.running:
+                branch.append(reporter_row(model, iteration, reporters))
+        rows.extend(finish_run(model, branch, iteration, reporters, max_steps))
+    model.close()
+    return finish_rows(rows, output)
+
+
+def run_scenarios(kwargs, policies, iteration, max_steps, reporters, data_collection_period=1, output=None):
+    # Imported here: scenarios.py builds on this module's model import
+    from scenarios import run_scenario_model
+
+    rows = run_scenario_model(kwargs, policies, iteration, max_steps, reporters, data_collection_period)
+    return finish_rows(rows, output)
+
+
+def forked_runs(runs):
+    # Groups runs that differ only in policy (same iteration and other parameters)
+    groups = {}
+    for kwargs, iteration in runs:
+        base = {k: v for k, v in kwargs.items() if k not in ("car_toll", "fare_discount")}
+        key = (iteration, repr(sorted(base.items())))
+        policy = (kwargs.get("car_toll", 0.0), kwargs.get("fare_discount", 0.0))
+        groups.setdefault(key, (base, [], iteration))[1].append(policy)
+    return list(groups.values())
+
+
+def task_runs(func, args):
+    # The (kwargs, iteration) runs one task covers
+    if func is run_model:
+        return [(args[0], args[1])]
+    base, policies, iteration = args[:3]
+    return [
+        ({**base, "car_toll": car_toll, "fare_discount": fare_discount}, iteration)
+        for car_toll, fare_discount in policies
+    ]
+
+
+def label_rows(rows, kwargs, iteration, reporters):
+    # Stored rows (Step plus reporters) as sweep rows for this run
+    return [
+        {
+            "fare_discount": kwargs.get("fare_discount", 0.0),
+            "car_toll": kwargs.get("car_toll", 0.0),
+            "iteration": iteration,
+            "Step": row["Step"],
+            **{name: row[name] for name in reporters},
+            **({"stopped_step": row["stopped_step"]} if "stopped_step" in row else {}),
+        }
+        for row in rows
+    ]
+
+
+def store_task(store, func, args):
+    # Replaces a task by one that computes only its runs missing from store, with every
+    # model reporter so later sweeps can ask for any of them. The task's policy group stays
+    # one task, so progress totals do not depend on what is stored.
+    *inputs, max_steps, reporters, data_collection_period, output = args
+    cached, missing = [], []
+    for kwargs, iteration in task_runs(func, args):
+        rows = store.get(kwargs, max_steps, data_collection_period, reporters)
+        if rows is None:
+            missing.append((kwargs, iteration))
+        else:
+            cached.extend(label_rows(rows, kwargs, iteration, reporters))
+    if not missing:
+        return run_stored, (store, None, None, reporters, cached, output)
+    stored_reporters = list(dict.fromkeys([*MODEL_REPORTERS, *reporters]))
+    if func is not run_model:
+        inputs[1] = [(kwargs.get("car_toll", 0.0), kwargs.get("fare_discount", 0.0)) for kwargs, _ in missing]
+    args = (*inputs, max_steps, stored_reporters, data_collection_period, None)
+    return run_stored, (store, func, args, reporters, cached, output)
+
+
+def run_stored(store, func, args, reporters, cached, output=None):
+    # Runs the task (if anything was missing), saves each new run and returns its rows
+    # together with the cached ones
+    rows = []
+    if func is not None:
+        computed = func(*args)
+        max_steps, _, data_collection_period, _ = args[-4:]
+        for kwargs, iteration in task_runs(func, args):
+            policy = (kwargs.get("car_toll", 0.0), kwargs.get("fare_discount", 0.0))
+            run_rows = [row for row in computed if (row["car_toll"], row["fare_discount"]) == policy]
+            store.put(kwargs, max_steps, data_collection_period, [
+                {name: value for name, value in row.items() if name not in SWEEP_KEYS or name == "Step"}
+                for row in run_rows
+            ])
+            rows.extend(label_rows(run_rows, kwargs, iteration, reporters))
+    return finish_rows(cached + rows, output)
+
+
+def iter_runs(
+    runs,
+    max_steps=24,
+    reporters=None,
+    data_collection_period=1,
+    processes=None,
+    max_tasks_per_child=None,
+    fork_warmup=False,
+    output=None,
+    batch_scenarios=False,
+    store=None,
+):
+    # Runs explicit (kwargs, iteration) pairs and yields each task's rows as soon as it
+    # finishes. Workers are reused across tasks by default; max_tasks_per_child recycles them
+    # so a finished 2M-agent run hands its memory back before the next one starts. Recycling
+    # makes the pool start workers with spawn instead of fork, which costs seconds per task
+    # on small runs, so only sweeps of large populations should ask for it. With fork_warmup,
+    # a task is one warm-up plus all policy cells branched from it. With output (a
+    # directory), rows are written there as Parquet (see sinks.py) and the yielded lists are
+    # empty. With batch_scenarios, a task is one ScenarioModel advancing all those policy
+    # cells together (see scenarios.py). With store (a ResultStore or its directory), stored
+    # runs are read back instead of computed and newly computed runs are added to it (see
+    # result_store.py).
+    reporters = list(MODEL_REPORTERS if reporters is None else reporters)
+    if batch_scenarios:
+        tasks = [
+            (run_scenarios, (base, policies, iteration, max_steps, reporters, data_collection_period, output))
+            for base, policies, iteration in forked_runs(runs)
+        ]
+    elif fork_warmup:
+        tasks = [
+            (run_forked, (base, policies, iteration, max_steps, reporters, data_collection_period, output))
+            for base, policies, iteration in forked_runs(runs)
+        ]
+    else:
+        tasks = [
+            (run_model, (kwargs, iteration, max_steps, reporters, data_collection_period, output))
+            for kwargs, iteration in runs
+        ]
+    if store is not None:
+        store = ResultStore(store) if isinstance(store, (str, os.PathLike)) else store
+        tasks = [store_task(store, func, args) for func, args in tasks]
+        # Fully stored tasks are answered here rather than by a worker
+        for func, args in tasks:
+            if args[1] is None:
+                yield func(*args)
+        tasks = [(func, args) for func, args in tasks if args[1] is not None]
+        if not tasks:
+            return
+    processes = os.cpu_count() if processes is None else processes
+
+    if processes == 1:
+        for func, args in tasks:
+            yield func(*args)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=min(processes, len(tasks)), max_tasks_per_child=max_tasks_per_child
+    ) as executor:
+        futures = [executor.submit(func, *args) for func, args in tasks]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def iter_sweep(
+    parameters,
+    iterations=1,
+    max_steps=24,
+    reporters=None,
+    data_collection_period=1,
+    processes=None,
+    seed=None,
+    max_tasks_per_child=None,
+    fork_warmup=False,
+    output=None,
+    batch_scenarios=False,
+    store=None,
+):
+    runs = sweep_runs(parameters, iterations, seed)
+    yield from iter_runs(
+        runs, max_steps, reporters, data_collection_period, processes, max_tasks_per_child, fork_warmup,
+        output, batch_scenarios, store,
+    )
+
+
+def run_sweep(parameters, iterations=1, max_steps=24, reporters=None, data_collection_period=1,
+              processes=None, seed=None, max_tasks_per_child=None, fork_warmup=False, progress=None,
+              output=None, batch_scenarios=False, store=None):
+    # Tidy frame with one row per (fare_discount, car_toll, iteration, Step). With output, the
+    # rows stream to a Parquet dataset there instead and the lazy dataset is returned. With
+    # store, only the cells and iterations not already stored are run.
+    rows = []
+    runs = sweep_runs(parameters, iterations)
+    total = len(forked_runs(runs)) if fork_warmup or batch_scenarios else len(runs)
+    for done, run_rows in enumerate(iter_sweep(
+        parameters, iterations, max_steps, reporters, data_collection_period,
+        processes, seed, max_tasks_per_child, fork_warmup, output, batch_scenarios, store,
+    ), start=1):
+        rows.extend(run_rows)
+        if progress is not None:
+            progress(done, total)
+    if output is not None:
+        return reporter_dataset(output)
+    return pd.DataFrame(rows).sort_values(SWEEP_KEYS, ignore_index=True)
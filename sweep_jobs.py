@@ -0,0 +1,66 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from sweep import SWEEP_KEYS, forked_runs, iter_sweep, sweep_runs
+
+# Background policy sweeps for the dashboard. Jobs are memoized by their full argument set,
+# so re-renders and repeat visits attach to the running (or finished) job instead of
+# starting a new sweep. Sweeps run one at a time; each already uses every core.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sweep")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class SweepJob:
+    def __init__(self, parameters, **sweep_kwargs):
+        self.parameters = parameters
+        self.sweep_kwargs = sweep_kwargs
+        runs = sweep_runs(parameters, sweep_kwargs.get("iterations", 1))
+        batched = sweep_kwargs.get("fork_warmup") or sweep_kwargs.get("batch_scenarios")
+        self.total = len(forked_runs(runs)) if batched else len(runs)
+        self.completed = 0
+        self.done = False
+        self.error = None
+        self.rows = []
+        self.changed = threading.Condition()
+
+    def run(self):
+        try:
+            for run_rows in iter_sweep(self.parameters, **self.sweep_kwargs):
+                with self.changed:
+                    self.rows.extend(run_rows)
+                    self.completed += 1
+                    self.changed.notify_all()
+        except Exception as e:
+            self.error = e
+        with self.changed:
+            self.done = True
+            self.changed.notify_all()
+
+    def wait_for_progress(self, completed, timeout=None):
+        # Blocks until more than `completed` runs have finished (or the job ends)
+        with self.changed:
+            self.changed.wait_for(lambda: self.done or self.completed > completed, timeout)
+            return self.completed
+
+    def frame(self):
+        with self.changed:
+            rows = list(self.rows)
+        if not rows:
+            return pd.DataFrame(columns=SWEEP_KEYS)
+        return pd.DataFrame(rows).sort_values(SWEEP_KEYS, ignore_index=True)
+
+
+def sweep_key(parameters, sweep_kwargs):
+    return repr((sorted(parameters.items()), sorted(sweep_kwargs.items())))
+
+
+def sweep_job(parameters, **sweep_kwargs):
+    # Returns the job for this argument set, starting it in the background on first use
+    key = sweep_key(parameters, sweep_kwargs)
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is None or job.error is not None:
+            job = _jobs[key] = SweepJob(parameters, **sweep_kwargs)
+            _executor.submit(job.run)
+    return job